@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Persistent SQLite cache of R package introspection, shared across packages and runs."""
+
+import json
+import os
+import sqlite3
+from r2g2 import __version__
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS installed (
+    name TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    description TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS introspection (
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    generator_version TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (name, version)
+);
+'''
+
+
+def default_cache_path():
+    """Return $R2G2_CACHE, or introspection.sqlite in the user cache directory."""
+    if os.environ.get('R2G2_CACHE'):
+        return os.environ['R2G2_CACHE']
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'r2g2', 'introspection.sqlite')
+
+
+class IntrospectionCache(object):
+    """
+    Introspection results keyed by (package, version).
+
+    Installed versions are remembered together with the size and mtime of the package's DESCRIPTION
+    file, so they can be checked again without starting R.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_cache_path()
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connection = sqlite3.connect(self.path, timeout=60)
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def installed_version(self, name):
+        """Return the installed version of a package, or None if unknown or reinstalled since."""
+        row = self.connection.execute(
+            'SELECT version, description, mtime, size FROM installed WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return None
+        version, description, mtime, size = row
+        try:
+            stat = os.stat(description)
+        except OSError:
+            return None
+        if stat.st_mtime != mtime or stat.st_size != size:
+            return None
+        return version
+
+    def record_installed(self, name, version, description):
+        """Remember the installed version of a package and the path of its DESCRIPTION file."""
+        stat = os.stat(description)
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO installed VALUES (?, ?, ?, ?, ?)',
+                                    (name, version, description, stat.st_mtime, stat.st_size))
+
+    def load(self, name, version):
+        """Return the introspection data stored for (name, version), or None."""
+        row = self.connection.execute(
+            'SELECT data FROM introspection WHERE name = ? AND version = ? AND generator_version = ?',
+            (name, version, __version__)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def store(self, name, version, data):
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO introspection VALUES (?, ?, ?, ?)',
+                                    (name, version, __version__, json.dumps(data)))
+
+    def close(self):
+        self.connection.close()
+
+
+def open_cache(path=None):
+    """Open the introspection cache, or return None if it cannot be used."""
+    try:
+        return IntrospectionCache(path)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Introspection cache disabled, unable to open {path or default_cache_path()}: {e}")
+        return None
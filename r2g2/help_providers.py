@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Providers of R documentation for the functions of a package."""
+
+import hashlib
+from r2g2.utils import to_docstring, unroll_vector_to_text
+
+# Loads the complete Rd database of a package, keyed by topic
+RD_DB = '''
+function(package) {
+    db <- tools::Rd_db(package)
+    names(db) <- sub("\\\\.[Rr]d$", "", basename(names(db)))
+    db
+}
+'''
+
+# Indexes an Rd database in a single call: the aliases, title and Rd source of every topic, and the
+# description of every \item of its \arguments section
+RD_DB_INDEX = '''
+function(db) {
+    aliases <- lapply(db, function(rd) tools:::.Rd_get_metadata(rd, "alias"))
+    items <- lapply(db, function(rd) {
+        section <- tools:::.Rd_get_section(rd, "arguments")
+        Filter(function(x) identical(attr(x, "Rd_tag"), "\\\\item") && length(x) == 2, section)
+    })
+    # [[ drops the Rd class of item fragments, which as.character() would then deparse as R lists
+    item_text <- function(x) paste(as.character(structure(x, class = "Rd"), deparse = TRUE), collapse = "")
+    list(topic = rep(names(db), lengths(aliases)),
+         alias = as.character(unlist(aliases, use.names = FALSE)),
+         title = vapply(db, function(rd) paste(tools:::.Rd_get_metadata(rd, "title"), collapse = " "), ""),
+         source = vapply(db, function(rd) paste(as.character(rd, deparse = TRUE), collapse = ""), ""),
+         argument_topic = rep(names(db), lengths(items)),
+         argument_names = as.character(unlist(lapply(items, function(topic_items) {
+             vapply(topic_items, function(item) item_text(item[[1]]), "")
+         }), use.names = FALSE)),
+         argument_text = as.character(unlist(lapply(items, function(topic_items) {
+             vapply(topic_items, function(item) item_text(item[[2]]), "")
+         }), use.names = FALSE)))
+}
+'''
+
+# Renders every topic of an Rd database to plain text in a single call, as an RST literal block.
+# Topics that Rd2txt cannot render are NA.
+RD2TXT = '''
+function(db) {
+    vapply(db, function(rd) {
+        tryCatch({
+            lines <- character()
+            con <- textConnection("lines", "w", local = TRUE)
+            tools::Rd2txt(rd, out = con, options = list(underline_titles = FALSE))
+            close(con)
+            paste0("::\\n\\n", paste0("  ", lines, collapse = "\\n"))
+        }, error = function(e) NA_character_)
+    }, "")
+}
+'''
+
+# Rd markup of the ellipsis in \item names
+RD_DOTS = {'\\dots': '...', '\\ldots': '...'}
+
+# Renderers of RdHelpProvider: rd2txt renders in R, docstring walks the sections in Python
+HELP_RENDERERS = ('rd2txt', 'docstring')
+
+
+def render_pages(rname, help_pages):
+    """Join help pages into RST, returning (help_rst, description); raises when a page cannot be rendered."""
+    description = ''
+    docstrings = []
+    for i, help_page in enumerate(help_pages):
+        docstrings.append(to_docstring(help_page))
+        if 'title' in list(help_page.sections.keys()) and not description:
+            description = unroll_vector_to_text(help_page.sections['title'])
+    help_rst = "\n\n".join(docstrings)
+    if i > 1:
+        print(f"{rname} had multiple pages: {i}, {tuple(help_pages)}")
+    return help_rst, description
+
+
+def help_from_pages(rname, help_pages, package_obj):
+    """Join help pages into RST, returning (help_rst, description), or the docstring of package_obj."""
+    try:
+        return render_pages(rname, help_pages)
+    except Exception as e:
+        print(f"Falling back to docstring: {rname}, {e}")
+        return package_obj.__doc__, ''
+
+
+class PagesHelpProvider(object):
+    """Look up help with rpy2's pages(), which searches every installed package on each call."""
+
+    # Pages may come from any installed package, so they cannot be indexed
+    index = None
+
+    def topic(self, alias):
+        return None
+
+    def arguments(self, alias):
+        return {}
+
+    def help(self, rname, package_obj):
+        from rpy2.robjects.help import pages
+        return help_from_pages(rname, pages(rname), package_obj)
+
+
+class RdHelpProvider(object):
+    """
+    Serve help for a single package from its Rd database, loaded once.
+    
+    index is a dict of topics_by_alias, titles, topic_digests and the argument descriptions of every
+    topic, as built by build_index(); when it is given, e.g. from the introspection cache, the Rd 
+    database is only loaded to render pages.
+    With the rd2txt renderer all topics are rendered by R at once, on the first call to help() or
+    render_all(); topics it fails on are rendered from their sections. Rendered help is kept per 
+    topic, so that the aliases documented by one topic share a single rendering.
+    """
+
+    def __init__(self, r_name, index=None, renderer='rd2txt'):
+        self.r_name = r_name
+        self.renderer = renderer
+        self._db = None
+        self._rendered = None
+        self._help_by_topic = {}
+        if index is None:
+            index = self.build_index()
+        self.index = index
+        self.topics_by_alias = index['topics_by_alias']
+        self.titles = index['titles']
+        self.topic_digests = index['topic_digests']
+        self.arguments_by_topic = index.get('arguments', {})
+
+    @property
+    def db(self):
+        if self._db is None:
+            from rpy2 import robjects
+            self._db = robjects.r(RD_DB)(self.r_name)
+        return self._db
+
+    def build_index(self):
+        from rpy2 import robjects
+        rd_index = robjects.r(RD_DB_INDEX)(self.db)
+        topics_by_alias = {}
+        for alias, topic in zip(rd_index.rx2('alias'), rd_index.rx2('topic')):
+            # The first topic documenting an alias wins, as with help()
+            topics_by_alias.setdefault(alias, topic)
+        titles = rd_index.rx2('title')
+        sources = rd_index.rx2('source')
+        arguments = {}
+        for topic, names, text in zip(rd_index.rx2('argument_topic'), rd_index.rx2('argument_names'), 
+                                      rd_index.rx2('argument_text')):
+            # An item may document several arguments, e.g. \item{x, y}{...}
+            for name in names.split(','):
+                name = RD_DOTS.get(name.strip(), name.strip())
+                arguments.setdefault(topic, {}).setdefault(name, text.strip())
+        return {
+            'topics_by_alias': topics_by_alias,
+            'titles': dict(zip(titles.names, titles)),
+            'topic_digests': {topic: hashlib.sha256(source.encode('utf-8')).hexdigest() 
+                              for topic, source in zip(sources.names, sources)},
+            'arguments': arguments,
+        }
+
+    def topic(self, alias):
+        """Return the Rd topic documenting alias, or None."""
+        return self.topics_by_alias.get(alias)
+
+    def arguments(self, alias):
+        """Return {argument name: Rd description} from the topic documenting alias."""
+        return self.arguments_by_topic.get(self.topic(alias), {})
+
+    def pages(self, alias):
+        topic = self.topic(alias)
+        if topic is None:
+            return ()
+        from rpy2.robjects.help import Page
+        return (Page(self.db.rx2(topic)),)
+
+    def render_all(self):
+        """Return {topic: help_rst} for every topic Rd2txt could render."""
+        if self._rendered is None:
+            self._rendered = {}
+            try:
+                from rpy2 import robjects
+                from rpy2.rinterface import NA_Character
+                rendered = robjects.r(RD2TXT)(self.db)
+                self._rendered = {topic: text for topic, text in zip(rendered.names, rendered)
+                                  if text is not NA_Character}
+            except Exception as e:
+                print(f"Unable to render the Rd database of {self.r_name}, rendering help pages: {e}")
+        return self._rendered
+
+    def render_topic(self, alias):
+        """Return (help_rst, description) of the topic documenting alias, rendering it on first use."""
+        topic = self.topic(alias)
+        if topic is None:
+            raise KeyError(f"No Rd topic documents {alias}")
+        if topic not in self._help_by_topic:
+            if self.renderer == 'rd2txt' and topic in self.render_all():
+                self._help_by_topic[topic] = self._rendered[topic], self.titles.get(topic, '')
+            else:
+                self._help_by_topic[topic] = render_pages(alias, self.pages(alias))
+        return self._help_by_topic[topic]
+
+    def render_topics(self, aliases):
+        """Render the topics documenting aliases ahead of help(), e.g. before forking workers that share them."""
+        for alias in aliases:
+            if self.topic(alias) is not None:
+                try:
+                    self.render_topic(alias)
+                except Exception:
+                    pass
+
+    def help(self, rname, package_obj):
+        try:
+            return self.render_topic(rname)
+        except Exception:
+            return help_from_pages(rname, self.pages(rname), package_obj)
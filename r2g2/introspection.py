@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Bulk introspection of R packages."""
+
+import fnmatch
+import os
+from collections import OrderedDict, namedtuple
+from r2g2.utils import str_typeint, str_typeof
+
+# A formal argument of an R function: the SEXP type, first value and length describe its default
+# choices are the elements of a literal character vector default, e.g. c("holm", "BH"), else None
+Formal = namedtuple('Formal', ['name', 'help', 'r_type', 'value', 'length', 'choices'], defaults=(None,))
+
+# Value types whose first element is used as the default of the Galaxy input
+VALUE_TYPES = ('INTSXP', 'LGLSXP', 'REALSXP', 'STRSXP')
+
+# Returns the formals of every exported function and of every S4 method of its exported generics as
+# one columnar list, one row per formal, together with the S3 method registry of the namespace. S4
+# methods are keyed by their Rd alias, e.g. "plot,MyClass-method", and read from the generic's method
+# table once; methods defined with extra arguments wrap them in a .local function whose formals are used.
+# Defaults that are literal c() calls of single strings are folded, without evaluating them, into
+# their elements joined by the unit separator
+HARVEST_SIGNATURES = '''
+function(package) {
+    first_value <- function(value) {
+        if (!is.atomic(value) || length(value) == 0 || is.na(value[[1]])) {
+            "NA"
+        } else if (is.double(value)) {
+            sprintf("%.17g", value[[1]])
+        } else {
+            as.character(value[[1]])
+        }
+    }
+    literal_choices <- function(value) {
+        if (!is.call(value) || !identical(value[[1]], as.name("c")) || length(value) < 2) return("")
+        items <- as.list(value)[-1]
+        if (!all(vapply(items, function(x) is.character(x) && length(x) == 1 && !is.na(x), TRUE))) return("")
+        paste(unlist(items), collapse = "\\037")
+    }
+    formal_rows <- function(key, fmls) {
+        list(
+            fun = rep(key, length(fmls)),
+            formal = names(fmls),
+            type = vapply(fmls, typeof, ""),
+            length = vapply(fmls, length, 1L),
+            first = vapply(fmls, first_value, ""),
+            choices = vapply(fmls, literal_choices, ""),
+            help = vapply(seq_along(fmls), function(i) {
+                paste(capture.output(print(fmls[i])), collapse = "\\n")
+            }, "")
+        )
+    }
+    method_formals <- function(method) {
+        b <- body(method)
+        if (is.call(b) && identical(b[[1]], as.name("{")) && length(b) >= 2) {
+            local <- b[[2]]
+            if (is.call(local) && identical(local[[1]], as.name("<-")) && identical(local[[2]], as.name(".local"))) {
+                return(formals(eval(local[[3]], environment(method))))
+            }
+        }
+        formals(method)
+    }
+    ns <- asNamespace(package)
+    exports <- sort(getNamespaceExports(package))
+    functions <- character()
+    s4_alias <- character()
+    s4_generic <- character()
+    s4_signature <- character()
+    rows <- list()
+    for (name in exports) {
+        f <- tryCatch(getExportedValue(package, name), error = function(e) NULL)
+        if (!is.function(f)) next
+        functions <- c(functions, name)
+        fmls <- formals(args(f))
+        if (length(fmls) > 0) rows[[name]] <- formal_rows(name, fmls)
+        if (!methods::is(f, "genericFunction")) next
+        table <- tryCatch(methods::findMethods(name, where = ns), error = function(e) list())
+        for (i in seq_along(table)) {
+            method <- table[[i]]
+            signature <- as.character(method@defined)
+            # Rd aliases of methods leave out trailing "ANY" classes
+            while (length(signature) > 1 && signature[[length(signature)]] == "ANY") {
+                signature <- signature[-length(signature)]
+            }
+            alias <- paste0(name, ",", paste(signature, collapse = ","), "-method")
+            if (alias %in% s4_alias) next
+            s4_alias <- c(s4_alias, alias)
+            s4_generic <- c(s4_generic, name)
+            s4_signature <- c(s4_signature, paste(signature, collapse = ","))
+            fmls <- method_formals(method)
+            if (length(fmls) > 0) rows[[alias]] <- formal_rows(alias, fmls)
+        }
+    }
+    column <- function(name) unname(unlist(lapply(rows, `[[`, name)))
+    s3 <- getNamespaceInfo(package, "S3methods")
+    s3_method <- ifelse(is.na(s3[, 3]), paste(s3[, 1], s3[, 2], sep = "."), s3[, 3])
+    list(functions = functions,
+         fun = as.character(column("fun")),
+         formal = as.character(column("formal")),
+         type = as.character(column("type")),
+         length = as.integer(column("length")),
+         first = as.character(column("first")),
+         choices = as.character(column("choices")),
+         help = as.character(column("help")),
+         s3_generic = as.character(s3[, 1]),
+         s3_method = as.character(s3_method),
+         s4_alias = s4_alias,
+         s4_generic = s4_generic,
+         s4_signature = s4_signature)
+}
+'''
+
+
+def format_value(r_type, value):
+    """Format a first value sent by R the way str() formats the corresponding rpy2 element."""
+    if value == 'NA':
+        return value
+    if r_type == 'INTSXP':
+        return str(int(value))
+    if r_type == 'LGLSXP':
+        return str(value == 'TRUE')
+    if r_type == 'REALSXP':
+        return str(float(value))
+    return value
+
+
+def formals_from_function(package_obj):
+    """Read the formals of a function through rpy2 proxies, one round-trip at a time."""
+    formals = []
+    for formal_name, formal_value in package_obj.formals().items():
+        r_type = None
+        value = None
+        length = None
+        try:
+            # Extract type information from the parameter
+            value_name, value_value = list(formal_value.items())[0]
+            value_type = str_typeint(value_value.typeof)
+            if value_type in VALUE_TYPES:
+                value = str(value_value[0])
+            r_type = value_type
+            length = len(list(value_value))
+        except Exception as e:
+            print(f'Error getting input param info: {e}')
+        formals.append(Formal(formal_name, str(formal_value).strip(), r_type, value, length))
+    return formals
+
+
+def harvest_signatures(r_name):
+    """
+    Return the signatures, S3 methods and S4 methods of a package, using a single R call.
+    
+    Signatures are {rname: [Formal, ...]} for every exported function and every S4 method alias,
+    S3 methods are {method: generic} for every method registered by the namespace and S4 methods are
+    {alias: {'generic': rname, 'signature': [class, ...]}} for the methods of exported generics.
+    """
+    from rpy2 import robjects
+    harvest = robjects.r(HARVEST_SIGNATURES)(r_name)
+    s4_methods = OrderedDict((alias, {'generic': generic, 'signature': signature.split(',')})
+                             for alias, generic, signature in zip(harvest.rx2('s4_alias'), harvest.rx2('s4_generic'),
+                                                                  harvest.rx2('s4_signature')))
+    signatures = OrderedDict((rname, []) for rname in list(harvest.rx2('functions')) + list(s4_methods))
+    columns = [harvest.rx2(name) for name in ('fun', 'formal', 'type', 'length', 'first', 'choices', 'help')]
+    for fun, formal_name, typeof, length, first, choices, help in zip(*columns):
+        r_type = str_typeof(typeof)
+        value = format_value(r_type, first) if r_type in VALUE_TYPES else None
+        signatures[fun].append(Formal(formal_name, help.strip(), r_type, value, length, 
+                                      choices.split('\x1f') if choices else None))
+    s3_methods = OrderedDict(zip(harvest.rx2('s3_method'), harvest.rx2('s3_generic')))
+    return signatures, s3_methods, s4_methods
+
+
+def package_description(r_name):
+    """Return the path of the DESCRIPTION file of an installed package."""
+    from rpy2 import robjects
+    return os.path.join(robjects.r['find.package'](r_name)[0], 'DESCRIPTION')
+
+
+class PackageIntrospection(object):
+    """
+    What r2g2-package needs to know about a package before processing its functions.
+    
+    functions is a list of (name, rname) for the bindings of the imported package, signatures maps
+    the rnames of exported functions and the aliases of S4 methods to their Formal records, help_index
+    is the index of a RdHelpProvider, s3_methods maps registered S3 methods to their generic and
+    s4_methods maps S4 method aliases to their generic and signature. All but functions are None when
+    they could not be computed.
+    """
+
+    # Version of the harvest, so that data cached by an older one is introspected again
+    FORMAT = 3
+
+    def __init__(self, functions, signatures=None, help_index=None, s3_methods=None, s4_methods=None):
+        self.functions = functions
+        self.signatures = signatures
+        self.help_index = help_index
+        self.s3_methods = s3_methods
+        self.s4_methods = s4_methods
+
+    def formals(self, rname):
+        if self.signatures is None:
+            return None
+        return self.signatures.get(rname)
+
+    def topic_digest(self, alias):
+        if self.help_index is None:
+            return None
+        topic = self.help_index['topics_by_alias'].get(alias)
+        if topic is None and self.s4_methods and alias in self.s4_methods:
+            # Undocumented methods are described by the page of their generic
+            topic = self.help_index['topics_by_alias'].get(self.s4_methods[alias]['generic'])
+        return self.help_index['topic_digests'].get(topic)
+
+    def select(self, include=None, exclude=None):
+        """
+        Select the functions to generate tools for.
+        
+        Returns (functions, methods, s4_tools): the (name, rname) of exported functions whose rname
+        matches one of the include glob patterns, if any, and none of the exclude patterns; 
+        {generic: [method, ...]} for the selected S3 methods, which are grouped under their generic 
+        instead of getting tools of their own; and {alias: (name, generic)} for the S4 methods of the
+        selected generics, which get a tool per method signature, listed in functions as (alias, alias),
+        in place of the tool of their generic. Without signatures every binding is selected.
+        """
+        s3_methods = self.s3_methods or {}
+        s4_aliases = OrderedDict()
+        for alias, method in (self.s4_methods or {}).items():
+            s4_aliases.setdefault(method['generic'], []).append(alias)
+        functions = []
+        methods = OrderedDict()
+        s4_tools = OrderedDict()
+        for name, rname in self.functions:
+            if rname is None:
+                if self.signatures is None:
+                    functions.append((name, rname))
+                continue
+            if self.signatures is not None and rname not in self.signatures:
+                continue
+            if include and not any(fnmatch.fnmatchcase(rname, pattern) for pattern in include):
+                continue
+            if exclude and any(fnmatch.fnmatchcase(rname, pattern) for pattern in exclude):
+                continue
+            generic = s3_methods.get(rname)
+            if generic is not None and generic != rname:
+                methods.setdefault(generic, []).append(rname)
+                continue
+            if rname in s4_aliases:
+                for alias in s4_aliases[rname]:
+                    functions.append((alias, alias))
+                    s4_tools[alias] = (name, rname)
+                continue
+            functions.append((name, rname))
+        return functions, methods, s4_tools
+
+    def to_dict(self):
+        signatures = None
+        if self.signatures is not None:
+            signatures = OrderedDict((rname, [list(formal) for formal in formals]) 
+                                     for rname, formals in self.signatures.items())
+        return {
+            'format': self.FORMAT,
+            'functions': [list(function) for function in self.functions],
+            'signatures': signatures,
+            'help_index': self.help_index,
+            's3_methods': self.s3_methods,
+            's4_methods': self.s4_methods,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        signatures = None
+        if data['signatures'] is not None:
+            signatures = OrderedDict((rname, [Formal(*formal) for formal in formals]) 
+                                     for rname, formals in data['signatures'].items())
+        return cls([tuple(function) for function in data['functions']], signatures, data['help_index'], 
+                   data.get('s3_methods'), data.get('s4_methods'))
+
+
+def introspect_package(r_name, package_importr, help_provider):
+    """Introspect an imported package in bulk."""
+    functions = []
+    for name in dir(package_importr):
+        try:
+            rname = getattr(package_importr, name).__rname__
+        except Exception:
+            rname = None
+        functions.append((name, rname))
+
+    # Read the formals of all exported functions in one call instead of per-argument proxies
+    try:
+        signatures, s3_methods, s4_methods = harvest_signatures(r_name)
+    except Exception as e:
+        print(f"Unable to harvest the signatures of {r_name}, reading formals per function: {e}")
+        signatures, s3_methods, s4_methods = None, None, None
+
+    return PackageIntrospection(functions, signatures, help_provider.index, s3_methods, s4_methods)
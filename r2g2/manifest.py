@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""On-disk manifest used to regenerate only the tools whose inputs changed."""
+
+import hashlib
+import json
+import os
+MANIFEST_FILENAME = 'r2g2_manifest.json'
+
+# Version of the generated tool XML: bump it whenever the templates or the generation change the
+# output for the same inputs, so that tools of a previous run are regenerated instead of kept
+GENERATOR_VERSION = 4
+
+
+def function_digest(formals, topic_digest, settings):
+    """
+    Digest everything a generated tool depends on.
+    
+    Returns None when the formals or the Rd topic are unknown, so the tool is always regenerated.
+    """
+    if formals is None or topic_digest is None:
+        return None
+    content = json.dumps({
+        'generator_version': GENERATOR_VERSION,
+        'settings': settings,
+        'formals': [list(formal) for formal in formals],
+        'topic': topic_digest,
+    }, sort_keys=True)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def write_if_changed(path, content):
+    """Write content to path unless the file already holds it; returns True if written."""
+    if os.path.exists(path):
+        with open(path) as fh:
+            if fh.read() == content:
+                return False
+    with open(path, 'w+') as out:
+        out.write(content)
+    return True
+
+
+class Manifest(object):
+    """Digests and file names of the tools generated into an output directory."""
+
+    def __init__(self, out_dir, tools=None):
+        self.out_dir = out_dir
+        self.tools = tools or {}
+
+    @classmethod
+    def load(cls, out_dir):
+        path = os.path.join(out_dir, MANIFEST_FILENAME)
+        try:
+            with open(path) as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return cls(out_dir)
+        if data.get('generator_version') != GENERATOR_VERSION:
+            return cls(out_dir)
+        return cls(out_dir, data.get('tools', {}))
+
+    def is_current(self, rname, digest):
+        """Return True if the tool for rname was generated from the same inputs and still exists."""
+        entry = self.tools.get(rname)
+        if digest is None or entry is None or entry['digest'] != digest:
+            return False
+        return os.path.exists(os.path.join(self.out_dir, entry['filename']))
+
+    def filename(self, rname):
+        return self.tools[rname]['filename']
+
+    def record(self, rname, digest, filename):
+        if digest is None:
+            self.tools.pop(rname, None)
+        else:
+            self.tools[rname] = {'digest': digest, 'filename': filename}
+
+    def remove_stale(self, rnames):
+        """Forget, and delete the tools of, functions that are not in rnames anymore."""
+        removed = []
+        for rname in sorted(set(self.tools) - set(rnames)):
+            filename = self.tools.pop(rname)['filename']
+            if filename in [entry['filename'] for entry in self.tools.values()]:
+                continue
+            path = os.path.join(self.out_dir, filename)
+            if os.path.exists(path):
+                os.remove(path)
+                removed.append(path)
+        return removed
+
+    def save(self):
+        path = os.path.join(self.out_dir, MANIFEST_FILENAME)
+        with open(f"{path}.tmp", 'w') as out:
+            json.dump({'generator_version': GENERATOR_VERSION, 'tools': self.tools}, out, indent=1, sort_keys=True)
+        os.replace(f"{path}.tmp", path)
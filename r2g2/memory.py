@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Per-function memory usage of a run, in Python (tracemalloc) and in the R heap, and periodic collection."""
+
+import gc
+import os
+import sys
+import tracemalloc
+from contextlib import contextmanager
+
+# Bytes of R's cons cells (Ncells) and vector cells (Vcells) on 64-bit platforms, see ?gc
+NCELL_BYTES = 56
+VCELL_BYTES = 8
+
+COLUMNS = ['package', 'function', 'pid', 'python_bytes', 'python_peak_bytes', 'python_total_bytes',
+           'r_bytes', 'r_total_bytes', 'max_rss_bytes', 'collected']
+
+# Recorded rows, None while the report is disabled
+_rows = None
+_gc_interval = 0
+_count = 0
+_r_heap = None
+
+
+def enable(report=False, gc_interval=0):
+    """Record a row per measured function if report, and collect garbage every gc_interval functions."""
+    global _rows, _gc_interval
+    _gc_interval = gc_interval
+    if report and _rows is None:
+        _rows = []
+        tracemalloc.start()
+
+
+def enabled():
+    """Whether a row is recorded per measured function."""
+    return _rows is not None
+
+
+def r_heap_bytes():
+    """Return the bytes used by the R heap after a collection of its youngest generation."""
+    global _r_heap
+    if _r_heap is None:
+        from rpy2 import robjects
+        _r_heap = robjects.r(f'''
+            function() {{
+                used <- gc(verbose = FALSE, full = FALSE)[, 1]
+                used[[1]] * {NCELL_BYTES} + used[[2]] * {VCELL_BYTES}
+            }}''')
+    return int(_r_heap()[0])
+
+
+def collect():
+    """Release unreachable rpy2 proxies, which unprotects their R objects, then run a full R collection."""
+    gc.collect()
+    from rpy2 import robjects
+    robjects.r('gc')(verbose=False, full=True)
+
+
+def max_rss_bytes():
+    """Return the peak resident set size of this process, or 0 where resource is missing, as on Windows."""
+    try:
+        import resource
+    except ImportError:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+@contextmanager
+def measure(package, function):
+    """Measure the memory the enclosed block keeps and peaks at, and collect garbage when it is due."""
+    global _count
+    if _rows is None and not _gc_interval:
+        yield
+        return
+    if _rows is not None:
+        python_before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        r_before = r_heap_bytes()
+    try:
+        yield
+    finally:
+        _count += 1
+        collected = bool(_gc_interval) and _count % _gc_interval == 0
+        if _rows is not None:
+            python_after, python_peak = tracemalloc.get_traced_memory()
+            r_after = r_heap_bytes()
+            _rows.append({
+                'package': package,
+                'function': function,
+                'pid': os.getpid(),
+                'python_bytes': python_after - python_before,
+                'python_peak_bytes': python_peak - python_before,
+                'python_total_bytes': python_after,
+                'r_bytes': r_after - r_before,
+                'r_total_bytes': r_after,
+                'max_rss_bytes': max_rss_bytes(),
+                'collected': collected,
+            })
+        if collected:
+            collect()
+
+
+def drain():
+    """Return and forget the rows of the functions measured so far; a forked worker returns them with each tool."""
+    if _rows is None:
+        return []
+    rows = list(_rows)
+    del _rows[:]
+    return rows
+
+
+def extend(rows):
+    """Add the rows measured in a worker, which keep the worker's pid, to the report of this process."""
+    if _rows is not None:
+        _rows.extend(rows)
+
+
+def write(path, top=10):
+    """Write the recorded rows as a tab-separated table and print the functions that kept the most memory."""
+    rows = _rows or []
+    with open(path, 'w') as out:
+        out.write('\t'.join(COLUMNS) + '\n')
+        for row in rows:
+            out.write('\t'.join(str(row[column]) for column in COLUMNS) + '\n')
+    growth = sorted(rows, key=lambda row: -(row['python_bytes'] + row['r_bytes']))[:top]
+    if growth:
+        print(f"{'Function':<40} {'Python (KB)':>12} {'R (KB)':>10} {'Max RSS (MB)':>13}")
+        for row in growth:
+            print(f"{row['package'] + '::' + row['function']:<40} {row['python_bytes'] / 1024:>12.1f} "
+                  f"{row['r_bytes'] / 1024:>10.1f} {row['max_rss_bytes'] / 2 ** 20:>13.1f}")
@@ -1,13 +1,12 @@
-import json
+import ast
 import os 
 import argparse
-import rpy2.robjects.packages as rpackages
-from rpy2.robjects.packages import PackageNotInstalledError
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
 from xml.sax.saxutils import quoteattr
 # from r_script_to_galaxy_wrapper import FakeArg
 from r2g2.anvio import FakeArg, SKIP_PARAMETER_NAMES, Parameter
+from r2g2.introspection import package_description
 from pathlib import Path
 import re
 import functools            
@@ -63,9 +62,9 @@ class CustomFakeArg(FakeArg):
         """Helper to wrap inner block in a properly indented ##if block."""
         indent = "        " * level
         return (
-            f"{indent}{'\t\t\t\t\t'}#if {condition}\n"
-            f"{inner}{'\t\t\t\t\t'}\n"
-            f"{indent}{'\t\t\t\t\t'}#end if\n"
+            f"{indent}\t\t\t\t\t#if {condition}\n"
+            f"{inner}\t\t\t\t\t\n"
+            f"{indent}\t\t\t\t\t#end if\n"
         )
 
     def dict_to_xml_and_command(self, spec, parent=None, subparser_name=None,
@@ -138,7 +137,7 @@ class CustomFakeArg(FakeArg):
 
                 when2.append(self.generate_param( o))
             parent.append(cond2)    
-            cmd_parts.append("    " * level + f"{ "\n    ".join(mut_cond_list)}\n\n")
+            cmd_parts.append("    " * level + "\n    ".join(mut_cond_list) + "\n\n")
             
         # Normal params
         for opt in spec.get("groups", {}).get("options", []):
@@ -481,6 +480,17 @@ def clean_r_script(lines):
     new_string = '\n'.join(new_lines)
     return new_string
 
+def tool_params_function(r_script_text):
+    """Return the start of the R tool_params() function, which records the arguments of the script's parser."""
+    cleaned_lines = clean_r_script(r_script_text.split('\n'))  
+    return "tool_params = function (){\n" + cleaned_lines.replace('ArgumentParser', "FakeArgumentParser")
+
+def worker_r_script(r_script_path):
+    """Return the tool_params() definition of an R script, as run by an RWorker."""
+    with open(r_script_path,  'r' ) as fh:
+        input = fh.read()
+    return tool_params_function(input) + "\n}"
+
 def edit_r_script(r_script_path, edited_r_script_path, fakearg_path=None, json_file_name="out.json"):
     
     if  not fakearg_path :
@@ -489,9 +499,8 @@ def edit_r_script(r_script_path, edited_r_script_path, fakearg_path=None, json_f
     with open(r_script_path,  'r' ) as fh:
         input = fh.read()
 
-    cleaned_lines = clean_r_script(input.split('\n'))  
-    new_input = """source("%s")\ntool_params = function (){\n"""%(fakearg_path) 
-    new_input += cleaned_lines.replace('ArgumentParser', "FakeArgumentParser")
+    new_input = """source("%s")\n"""%(fakearg_path) 
+    new_input += tool_params_function(input)
 
     lines_to_append = """
         write_json(args_list, path = "%s", pretty = TRUE, auto_unbox = TRUE)
@@ -504,7 +513,12 @@ def edit_r_script(r_script_path, edited_r_script_path, fakearg_path=None, json_f
     with open(edited_r_script_path,  'w' ) as fh:
         fh.write(new_input)
 
-def return_dependencies(r_script_path):
+def return_dependencies(r_script_path, cache=None):
+    """
+    Return (name, version) for every library loaded by an R script.
+    
+    Versions found in the introspection cache are used without importing the package in R.
+    """
     package_list = []
     packages = {'name':None, 'version':None}
     with open(r_script_path,  'r' ) as fh:
@@ -513,93 +527,27 @@ def return_dependencies(r_script_path):
             if "library(" in i and "argparse" not in i:
                 package_name = i.split('library(')[1].replace(')', '')
                 # print("262", package_name.replace(')', ''))
+                cached_version = cache.installed_version(package_name) if cache else None
+                if cached_version is not None:
+                    package_list.append((package_name, cached_version))
+                    continue
+                # Importing rpy2.robjects starts R, only do so for packages missing from the cache
+                import rpy2.robjects.packages as rpackages
+                from rpy2.robjects.packages import PackageNotInstalledError
                 try:
                     package_importr = rpackages.importr( package_name)
                     packages['name'] =  package_name
                     packages['version'] =  package_importr.__version__
                     package_list.append((package_name, package_importr.__version__))
+                    if cache:
+                        cache.record_installed(package_name, package_importr.__version__, 
+                                               package_description(package_name))
 
                 except PackageNotInstalledError:
                     print(f"❌ The R package {package_name} is not installed.")
                     package_list.append((package_name, ' '))
     return package_list
 
-def clean_json(json_file):
-    with open(json_file) as testread:
-        data = json.loads(testread.read())
-    cleaned_json = []
-    for i in data:
-        if "add_argument" in i:
-            cleaned_json.append("parser.add_argument"+i.split('.add_argument')[1])
-    return cleaned_json
-
-# def clean_json(json_file):
-#     with open(json_file) as testread:
-#         data = json.loads(testread.read())
-
-#     return data
-
-def json_to_python_for_param_info(json_file):
-    with open(json_file) as testread:
-        data = json.loads(testread.read())
-
-    # print(data)
-    parser_name = 'parser'     
-    args_string = '\n    '.join(data)
-    # print(args_string )
-    arg_str_function = f"""
-#!/usr/bin/env python
-import argparse
-
-def param_info_parsing(parent_locals):
-    parser = argparse.ArgumentParser()\n    %s
-    globals().update(parent_locals)
-
-    return parser
-param_info = param_info_parsing(dict(locals()))
-
-"""%(args_string)    
-    return arg_str_function
-
-def json_to_python(json_file, data_params=None, ignore_params=None):
-
-    data = clean_json(json_file)
-    parser_name = 'parser'     
-    args_string = '\n    '.join(data)
-    
-    # Format data_params as a python list string or None
-    data_params_str = str(data_params) if data_params else "None"
-    ignore_params_str = str(ignore_params) if ignore_params else "None"
-
-    arg_str_function = """
-#!/usr/bin/env python
-# from r_script_to_galaxy_wrapper import FakeArg
-from r2g2.parsers.r_parser import CustomFakeArg
-import json
-import argparse
-
-# def param_info_parsing(parent_locals):
-#     parser_1 = argparse.ArgumentParser()\\n   
-#     globals().update(parent_locals)
-#     return parser_1
-
-def r_script_argument_parsing(parent_locals, CustomFakeArg=CustomFakeArg, data_params=None, ignore_params=None):
-    __description__ = "test"
-    
-    parser = CustomFakeArg(description=__description__, data_params=data_params, ignore_params=ignore_params)\n    %s
-    globals().update(parent_locals)
-
-    param_info  =  param_info_parsing(dict(locals()))
-    # parser.param_cat = extract_simple_parser_info(param_info)
-
-    return parser
-
-blankenberg_parameters = r_script_argument_parsing(dict(locals()), data_params=%s, ignore_params=%s)
-
-"""%(args_string, data_params_str, ignore_params_str)
-    
-    return arg_str_function
-
 def extract_simple_parser_info(parser):
     def extract_from_parser(p):
         info = {'subparsers': {}, 'mutually_exclusive_groups': {}, 'groups': {}}
@@ -843,3 +791,64 @@ def logical(value):
         return False
     else:
         raise argparse.ArgumentTypeError(f"Invalid logical value: {value}. Only TRUE or FALSE allowed.")
+
+# Names the argument strings written by FakeArg.r may refer to, e.g. type=int; anything else is refused
+ARGUMENT_NAMES = {'int': int, 'float': float, 'str': str, 'bool': bool, 'logical': logical}
+
+# Parser methods the argument strings may call
+PARSER_METHODS = ('add_argument', 'add_argument_group', 'add_mutually_exclusive_group', 'add_subparsers', 'add_parser')
+
+def argument_value(node):
+    """Return the value of an argument node: a literal, or one of ARGUMENT_NAMES."""
+    if isinstance(node, ast.Name):
+        if node.id not in ARGUMENT_NAMES:
+            raise ValueError(f"Unsupported name in argument: {node.id}")
+        return ARGUMENT_NAMES[node.id]
+    return ast.literal_eval(node)
+
+def parse_argument_string(statement):
+    """
+    Parse an argument string written by FakeArg.r, e.g. "parser_group0 = parser.add_argument_group('Input')",
+    into (target, object name, method, args, kwargs) without executing it; target is None without assignment.
+    """
+    tree = ast.parse(statement.strip())
+    if len(tree.body) != 1:
+        raise ValueError(f"Expected a single call: {statement}")
+    node = tree.body[0]
+    target = None
+    if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+        target = node.targets[0].id
+        call = node.value
+    elif isinstance(node, ast.Expr):
+        call = node.value
+    else:
+        raise ValueError(f"Expected a call: {statement}")
+    if not (isinstance(call, ast.Call) and isinstance(call.func, ast.Attribute) 
+            and isinstance(call.func.value, ast.Name) and call.func.attr in PARSER_METHODS):
+        raise ValueError(f"Unsupported call: {statement}")
+    if any(isinstance(arg, ast.Starred) for arg in call.args) or any(keyword.arg is None for keyword in call.keywords):
+        raise ValueError(f"Unsupported unpacking: {statement}")
+    args = [argument_value(arg) for arg in call.args]
+    kwargs = {keyword.arg: argument_value(keyword.value) for keyword in call.keywords}
+    return target, call.func.value.id, call.func.attr, args, kwargs
+
+def load_parsers(arguments, data_params=None, ignore_params=None):
+    """
+    Build (CustomFakeArg, argparse parser) from the argument strings written by FakeArg.r, in one pass.
+
+    The argparse parser replays every call, keeping groups, mutually exclusive groups and subparsers
+    for extract_simple_parser_info(). The CustomFakeArg gets every add_argument and add_argument_group
+    call on itself, whichever group or subparser it was made on.
+    """
+    blankenberg_parameters = CustomFakeArg(description="test", data_params=data_params, ignore_params=ignore_params)
+    objects = {'parser': argparse.ArgumentParser()}
+    for statement in arguments:
+        target, name, method, args, kwargs = parse_argument_string(statement)
+        if name not in objects:
+            raise ValueError(f"Unknown parser {name}: {statement}")
+        result = getattr(objects[name], method)(*args, **kwargs)
+        if target is not None:
+            objects[target] = result
+        if method in ('add_argument', 'add_argument_group'):
+            getattr(blankenberg_parameters, method)(*args, **kwargs)
+    return blankenberg_parameters, objects['parser']
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A long-lived R session that extracts the argparse arguments of R scripts for r2g2-script."""
+
+import json
+import os
+import subprocess
+
+PARSERS_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKER_SCRIPT = os.path.join(PARSERS_DIR, 'r_worker.R')
+FAKEARG_SCRIPT = os.path.join(PARSERS_DIR, 'FakeArg.r')
+
+# Marks the reply lines of the worker, anything else it writes to stdout is passed through
+REPLY_PREFIX = 'R2G2\t'
+
+
+class RWorker(object):
+    """
+    One Rscript process, with FakeArg.r and its packages loaded once, serving a batch of scripts.
+
+    extract() sends the tool_params() definition of an edited script over the worker's stdin and
+    returns the argument strings that FakeArg.r recorded, as the edited script would write them to
+    its JSON file. The worker is started on first use, and again after it died.
+    """
+
+    def __init__(self, rscript='Rscript'):
+        self.rscript = rscript
+        self.process = None
+
+    def start(self):
+        self.process = subprocess.Popen([self.rscript, WORKER_SCRIPT, FAKEARG_SCRIPT], stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, text=True, encoding='utf-8')
+
+    def extract(self, code):
+        """Run the tool_params() definition in code and return the argument strings of its parser."""
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        lines = code.split('\n')
+        try:
+            self.process.stdin.write(f'{len(lines)}\n{code}\n')
+            self.process.stdin.flush()
+            while True:
+                line = self.process.stdout.readline()
+                if not line:
+                    raise EOFError
+                if line.startswith(REPLY_PREFIX):
+                    break
+                print(line, end='')
+        except (BrokenPipeError, EOFError):
+            self.close()
+            raise RuntimeError('The R worker exited before replying')
+        reply = json.loads(line[len(REPLY_PREFIX):])
+        for output in reply.get('output', []):
+            print(output)
+        if not reply['ok']:
+            raise RuntimeError(f"Unable to extract the arguments: {reply['error']}")
+        return reply['arguments']
+
+    def close(self):
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -4,7 +4,14 @@
 """A script to convert R library functions to Galaxy Tools."""
 
 import argparse
+import collections
+import contextlib
+import itertools
+import json
+import multiprocessing
 import os
+import time
+from multiprocessing.connection import wait
 from r2g2.config import CONFIG_SPLIT_DESIRED_OUTPUTS, SAVE_R_OBJECT_TEXT
 from r2g2.templates import (tool_xml, input_dataset, input_text, input_boolean, 
                      input_integer, input_float, input_select, 
@@ -12,98 +19,590 @@ from r2g2.templates import (tool_xml, input_dataset, input_text, input_boolean,
                      optional_input_text, optional_input_boolean,
                      optional_input_integer, optional_input_float,
                      optional_input_select, optional_input_not_determined,
-                     ellipsis_input, INPUT_NOT_DETERMINED_DICT)
-from r2g2.utils import simplify_text, to_docstring, unroll_vector_to_text, str_typeint
+                     input_choice, input_choice_option,
+                     optional_input_not_determined_expand, NOT_DETERMINED_SELECTS,
+                     ellipsis_input, INPUT_NOT_DETERMINED_DICT,
+                     rscript_selected, rscript_end, rscript_argument,
+                     rscript_argument_quoted, rscript_argument_dataset,
+                     rscript_argument_not_determined, rscript_argument_choice, rscript_ellipsis, 
+                     rscript_ellipsis_expand, ellipsis_input_expand)
+from r2g2.utils import describe_exitcode, simplify_text
+from r2g2.type_inference import infer_input_type
+from r2g2.help_providers import HELP_RENDERERS, PagesHelpProvider, RdHelpProvider
+from r2g2.introspection import (PackageIntrospection, formals_from_function, introspect_package, 
+                                package_description)
+from r2g2.cache import open_cache
+from r2g2 import memory, tracing
+from r2g2.manifest import Manifest, function_digest, write_if_changed
+from r2g2.writer import ARCHIVE_EXTENSIONS, ArchiveSink, DirectorySink, ToolWriter
 from r2g2.xml_generators import generate_macro_xml, generate_LOAD_MATRIX_TOOL_XML
-import rpy2.robjects.packages as rpackages
-from rpy2 import robjects
-from rpy2.robjects.help import pages
-from xml.sax.saxutils import quoteattr
+from xml.sax.saxutils import escape, quoteattr
+
+# rpy2 is imported where it is needed: it starts R, which costs seconds that --help, argument errors 
+# and runs served from the introspection cache should not pay
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--name", help="Package Name", required=True)
+    parser.add_argument("--name", help="Package Name; repeat to process several packages in one R session", 
+                        action='append', default=None)
+    parser.add_argument("--names_file", "--names-file", 
+                        help="File with one package per line: Name [[Conda] Package Name [[Conda] Package Version]]", 
+                        default=None)
     parser.add_argument("--package_name", help="[Conda] Package Name", default=None)
     parser.add_argument("--package_version", help="[Conda] Package Version", default=None)
     parser.add_argument("--out", help="Output directory", default='out')
+    parser.add_argument("--archive", help="Write all tools into this .tar.gz, .tgz, .tar or .zip archive instead of "
+                        "--out; every tool is regenerated", default=None)
     parser.add_argument("--create_load_matrix_tool", help="Output a tool that will create an RDS from a tabular matrix", 
                         action='store_true')
     parser.add_argument("--galaxy_tool_version", help="Additional Galaxy Tool Version", default='0.0.1')
+    parser.add_argument("--jobs", help="Number of worker processes to fork after importing the package", 
+                        type=int, default=1)
+    parser.add_argument("--force", help="Regenerate every tool, even if its inputs are unchanged since the last run", 
+                        action='store_true')
+    parser.add_argument("--cache", help="Path of the SQLite introspection cache (default: $R2G2_CACHE or ~/.cache/r2g2)", 
+                        default=None)
+    parser.add_argument("--no_cache", help="Do not read or write the introspection cache", action='store_true')
+    parser.add_argument("--help_renderer", help="Render tool help with R's Rd2txt in one pass per package, "
+                        "or from the help page sections in Python", choices=HELP_RENDERERS, default='rd2txt')
+    parser.add_argument("--include", help="Only generate tools for exported functions matching this glob pattern; "
+                        "may be repeated", action='append', default=None)
+    parser.add_argument("--exclude", help="Do not generate tools for functions matching this glob pattern; "
+                        "may be repeated", action='append', default=None)
+    parser.add_argument("--trace", help="Write a Chrome trace-event JSON file with a span per function and phase, "
+                        "for chrome://tracing or ui.perfetto.dev", default=None)
+    parser.add_argument("--isolate", help="Process every function in a forked worker of its own, so that a crash of R "
+                        "only loses that function", action='store_true')
+    parser.add_argument("--timeout", help="Give up on a function after this many seconds; implies --isolate", 
+                        type=float, default=None)
+    parser.add_argument("--failure_report", help="Write the functions and packages that failed, timed out or crashed "
+                        "to this JSON file", default=None)
+    parser.add_argument("--memory_report", "--memory-report", help="Write the Python (tracemalloc) and R heap memory "
+                        "kept by every function to this tab-separated file", default=None)
+    parser.add_argument("--gc_interval", help="Run the Python and R garbage collectors every this many functions, "
+                        "per worker; 0 to never force a collection", type=int, default=0)
 
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.timeout is not None and args.timeout <= 0:
+        parser.error("--timeout must be positive")
+    if args.gc_interval < 0:
+        parser.error("--gc_interval must not be negative")
+    if args.archive and not args.archive.endswith(ARCHIVE_EXTENSIONS):
+        parser.error(f"--archive must end with one of {', '.join(ARCHIVE_EXTENSIONS)}")
+
+    packages = [(r_name, args.package_name, args.package_version) for r_name in args.name or []]
+    if args.names_file:
+        packages.extend(read_names_file(args.names_file))
+    if not packages:
+        parser.error("one of --name or --names_file is required")
+    batch = len(packages) > 1
+    if batch and (args.package_name or args.package_version):
+        parser.error("--package_name and --package_version apply to a single package, use --names_file instead")
+
+    if args.trace:
+        tracing.enable()
+    memory.enable(report=bool(args.memory_report), gc_interval=args.gc_interval)
+    cache = None if args.no_cache else open_cache(args.cache)
+    archive = ArchiveSink(args.archive) if args.archive else None
+    summary = []
+    try:
+        for r_name, package_name, package_version in packages:
+            # Each package of a batch gets its own directory and macros file
+            if archive is not None:
+                out_dir = r_name if batch else ''
+            else:
+                out_dir = os.path.join(args.out, r_name) if batch else args.out
+            try:
+                with tracing.span(r_name, category='package'):
+                    summary.append(generate_package(r_name, out_dir, package_name=package_name, 
+                                                    package_version=package_version, 
+                                                    galaxy_tool_version=args.galaxy_tool_version, 
+                                                    create_load_matrix_tool=args.create_load_matrix_tool, 
+                                                    jobs=args.jobs, force=args.force, cache=cache, 
+                                                    help_renderer=args.help_renderer, 
+                                                    include=args.include, exclude=args.exclude, 
+                                                    isolate=args.isolate, timeout=args.timeout, 
+                                                    archive=archive))
+            except Exception as e:
+                if not batch:
+                    raise
+                print(f'Failed to process package {r_name}: {e}')
+                summary.append(dict(r_name=r_name, created=0, unchanged=0, skipped=0, error=str(e), 
+                                    failures=[dict(kind='package', message=str(e))]))
+    except BaseException:
+        if archive is not None:
+            archive.abort()
+            archive = None
+        raise
+    finally:
+        if cache:
+            cache.close()
+        if archive is not None:
+            archive.close()
+            print(f"Wrote archive: {args.archive} ({len(archive.contents)} files)")
+        if args.trace:
+            tracing.write(args.trace)
+            print(f"Wrote trace: {args.trace}")
+        if args.memory_report:
+            memory.write(args.memory_report)
+            print(f"Wrote memory report: {args.memory_report}")
+        if args.failure_report:
+            write_failure_report(args.failure_report, summary)
+            print(f"Wrote failure report: {args.failure_report}")
+
+    if batch:
+        print('')
+        print(f"{'Package':<30} {'Created':>8} {'Unchanged':>10} {'Skipped':>8}")
+        for row in summary:
+            status = f"  Failed: {row['error']}" if 'error' in row else ''
+            print(f"{row['r_name']:<30} {row['created']:>8} {row['unchanged']:>10} {row['skipped']:>8}{status}")
+        print(f"{'Total':<30} {sum(row['created'] for row in summary):>8} "
+              f"{sum(row['unchanged'] for row in summary):>10} {sum(row['skipped'] for row in summary):>8}")
+
+
+def write_failure_report(path, summary):
+    """Write the failures of every package of a run as JSON, keyed by package."""
+    report = dict((row['r_name'], row['failures']) for row in summary)
+    with open(path, 'w') as out:
+        json.dump({'packages': report, 'failed': sum(len(failures) for failures in report.values())}, 
+                  out, indent=2)
+
+
+def read_names_file(path):
+    """Read (r_name, package_name, package_version) tuples from a names file, skipping blanks and comments."""
+    packages = []
+    with open(path) as fh:
+        for line in fh:
+            fields = line.split('#', 1)[0].split()
+            if fields:
+                fields.extend([None] * (3 - len(fields)))
+                packages.append(tuple(fields[:3]))
+    return packages
 
-    r_name = args.name
-    package_name = args.package_name or r_name
+
+def import_package(r_name):
+    """Import an R package through rpy2, starting R on first use."""
+    import rpy2.robjects.packages as rpackages
+    return rpackages.importr(r_name)
+
+
+def generate_package(r_name, out_dir, package_name=None, package_version=None, galaxy_tool_version='0.0.1', 
+                     create_load_matrix_tool=False, jobs=1, force=False, cache=None, help_renderer='rd2txt', 
+                     include=None, exclude=None, isolate=False, timeout=None, archive=None):
+    """
+    Generate the tools of one R package into out_dir, returning a summary of created and skipped counts.
     
-    # Import the R package
-    package_importr = rpackages.importr(r_name)
-    package_version = args.package_version or package_importr.__version__
-    galaxy_tool_version = args.galaxy_tool_version
+    With an ArchiveSink as archive, out_dir is the directory of the package within the archive and 
+    every tool is generated, as the manifest of a previous run only applies to a directory.
+    """
+    package_name = package_name or r_name
+    package_importr = None
+    help_provider = None
+
+    # Reuse the introspection of an already seen (package, version) without starting R
+    installed_version = cache.installed_version(r_name) if cache else None
+    introspection = None
+    if installed_version is not None:
+        data = cache.load(r_name, installed_version)
+        if data is not None and data.get('format') == PackageIntrospection.FORMAT:
+            introspection = PackageIntrospection.from_dict(data)
+    if introspection is None:
+        # Import the R package
+        with tracing.span('importr'):
+            package_importr = import_package(r_name)
+        installed_version = package_importr.__version__
+
+        # Load the package documentation once instead of searching the help index per function
+        try:
+            with tracing.span('Rd database'):
+                help_provider = RdHelpProvider(r_name, renderer=help_renderer)
+        except Exception as e:
+            print(f"Unable to load the Rd database of {r_name}, falling back to help pages: {e}")
+            help_provider = PagesHelpProvider()
+
+        with tracing.span('introspection'):
+            introspection = introspect_package(r_name, package_importr, help_provider)
+        if cache:
+            cache.record_installed(r_name, installed_version, package_description(r_name))
+            cache.store(r_name, installed_version, introspection.to_dict())
+    package_version = package_version or installed_version
 
-    package_dict = {}
+    # Only exported functions get tools; S3 methods are listed in the help of their generic and S4
+    # generics get a tool per method signature
+    functions, s3_methods, s4_methods = introspection.select(include, exclude)
+    print(f"Selected {len(functions)} of {len(introspection.functions)} bindings of {r_name}, "
+          f"grouping {sum(len(methods) for methods in s3_methods.values())} S3 methods under their generic, "
+          f"with {len(s4_methods)} S4 methods")
+
+    # Only the names are kept, to detect duplicates; tools are handed to the writer as they are done
+    rnames = set()
+    created = 0
     skipped = 0
+    failures = []
+    written_bytes = 0
+    macro_saved_bytes = 0
 
-    # Create output directory if it doesn't exist
-    try:
-        os.makedirs(args.out)
-    except os.error:
-        pass
-
-    # Generate macro XML file
-    with open(os.path.join(args.out, f"{r_name}_macros.xml"), 'w+') as out:
-        out.write(generate_macro_xml(package_name, package_version, r_name, galaxy_tool_version))
-
-    # Generate load matrix tool if requested
-    if args.create_load_matrix_tool:
-        with open(os.path.join(args.out, "r_load_matrix.xml"), 'w+') as out:
-            out.write(generate_LOAD_MATRIX_TOOL_XML(package_name, package_version, r_name, galaxy_tool_version))
-
-    # Setup R browser function for downloading
-    robjects.r('''
-        ctr <- 0
-        dlBrowser <- function(url) {
-            print(paste("Fetching", url))
-            download.file(url, destfile = paste0("./html/", ctr, ".html"), method="wget")
-            ctr <- ctr + 1
-            ctr
-        }
-        options(browser=dlBrowser)
-    ''')
+    if archive is None:
+        # Create output directory if it doesn't exist
+        try:
+            os.makedirs(out_dir)
+        except os.error:
+            pass
+
+        # Generate macro XML file
+        write_if_changed(os.path.join(out_dir, f"{r_name}_macros.xml"), 
+                         generate_macro_xml(package_name, package_version, r_name, galaxy_tool_version))
+
+        # Generate load matrix tool if requested
+        if create_load_matrix_tool:
+            write_if_changed(os.path.join(out_dir, "r_load_matrix.xml"), 
+                             generate_LOAD_MATRIX_TOOL_XML(package_name, package_version, r_name, 
+                                                           galaxy_tool_version))
+        sink = DirectorySink(out_dir)
+    else:
+        sink = archive
+        force = True
+
+    # Find the functions whose tools were generated from the same inputs by a previous run
+    manifest = Manifest.load(out_dir) if archive is None else Manifest(out_dir)
+    settings = dict(package_name=package_name, package_version=package_version, r_name=r_name, 
+                    galaxy_tool_version=galaxy_tool_version, help_renderer=help_renderer)
+    names = [name for name, rname in functions]
+    digests = {}
+    unchanged = {}
+    for name, rname in functions:
+        if rname is None:
+            continue
+        digests[rname] = function_digest(introspection.formals(rname), introspection.topic_digest(rname), 
+                                         dict(settings, s3_methods=s3_methods.get(rname, [])))
+        if not force and manifest.is_current(rname, digests[rname]):
+            unchanged[name] = rname
+    not_r_objects = set(name for name, rname in functions if rname is None)
+    tasks = [(j, name) for j, name in enumerate(names) if name not in unchanged and name not in not_r_objects]
+
+    if tasks:
+        if package_importr is None:
+            with tracing.span('importr'):
+                package_importr = import_package(r_name)
+        if help_provider is None:
+            if introspection.help_index is not None:
+                help_provider = RdHelpProvider(r_name, index=introspection.help_index, renderer=help_renderer)
+            else:
+                help_provider = PagesHelpProvider()
+        if isinstance(help_provider, RdHelpProvider):
+            # Render every needed topic once, before forking, so that workers and aliases share it
+            task_names = set(name for j, name in tasks)
+            aliases = [rname for name, rname in functions if name in task_names]
+            aliases.extend(generic for binding, generic in s4_methods.values())
+            with tracing.span('render help'):
+                help_provider.render_topics(aliases)
+
+        # Setup R browser function for downloading
+        from rpy2 import robjects
+        robjects.r('''
+            ctr <- 0
+            dlBrowser <- function(url) {
+                print(paste("Fetching", url))
+                download.file(url, destfile = paste0("./html/", ctr, ".html"), method="wget")
+                ctr <- ctr + 1
+                ctr
+            }
+            options(browser=dlBrowser)
+        ''')
 
     # Process each function in the package
-    for j, name in enumerate(dir(package_importr)):
-        try:
-            package_obj = getattr(package_importr, name)
-            rname = package_obj.__rname__
-            
-            # Skip functions with dots in their names if needed
-            if '.' in rname and False:  # Currently disabled with False
-                print(f"Skipping: {rname}")
+    results = iter_processed_functions(package_importr, tasks, package_name, r_name, 
+                                       galaxy_tool_version, jobs=jobs, help_provider=help_provider, 
+                                       signatures=introspection.signatures, s3_methods=s3_methods, 
+                                       s4_methods=s4_methods, isolate=isolate, timeout=timeout)
+    # Write tools from a thread while the next function is processed; isolated functions are forked one
+    # at a time while tools are written, which must not happen with a writer thread running
+    writer = ToolWriter(sink, prefix=out_dir if archive is not None else '', threaded=not (isolate or timeout))
+    with writer, contextlib.closing(results):
+        if archive is not None:
+            writer.write(f"{r_name}_macros.xml", 
+                         generate_macro_xml(package_name, package_version, r_name, galaxy_tool_version))
+            if create_load_matrix_tool:
+                writer.write("r_load_matrix.xml", 
+                             generate_LOAD_MATRIX_TOOL_XML(package_name, package_version, r_name, galaxy_tool_version))
+        for j, name in enumerate(names):
+            if name in not_r_objects:
+                print(f'Skipping {j}: {name} is not an R object')
                 skipped += 1
                 continue
+            if name in unchanged:
+                rname = unchanged[name]
+                rnames.add(rname)
+                print(f"Unchanged: {os.path.join(out_dir, manifest.filename(rname))}")
+                print(f'Processed {j}: {name}')
+                continue
+            j, name, rname, xml_dict, error, (events, memory_rows) = next(results)
+            tracing.extend(events)
+            memory.extend(memory_rows)
+            if error is not None and error[0] != 'error':
+                kind, message = error
+                print(f'{kind.capitalize()} in {j}: {name}: {message}')
+                failures.append(dict(index=j, name=name, kind=kind, message=message))
+                skipped += 1
+                print(f'Processed {j}: {name}')
+                continue
+            try:
+                if error is not None:
+                    raise Exception(error[1])
+                if xml_dict is None:
+                    skipped += 1
+                    continue
                 
-            # Create the XML dictionary
-            xml_dict = process_function(package_obj, rname, package_name, r_name, galaxy_tool_version)
-            
-            # Write the tool XML file
-            assert rname not in package_dict, f"{rname} already exists!"
-            package_dict[rname] = xml_dict
-            with open(os.path.join(args.out, f"{xml_dict['id_underscore']}.xml"), 'w+') as out:
-                out.write(tool_xml % xml_dict)
-            print(f"Created: {os.path.join(args.out, xml_dict['id_underscore'] + '.xml')}")
+                # Queue the tool XML file
+                assert rname not in rnames, f"{rname} already exists!"
+                rnames.add(rname)
+                with tracing.span(rname, category='output'):
+                    with tracing.span('tool_xml'):
+                        content = tool_xml % xml_dict
+                    writer.write(f"{xml_dict['id_underscore']}.xml", content, key=rname)
+                created += 1
+                written_bytes += len(content)
+                macro_saved_bytes += xml_dict['macro_saved_bytes']
+                manifest.record(rname, digests.get(rname), f"{xml_dict['id_underscore']}.xml")
+                print(f"Created: {os.path.join(out_dir, xml_dict['id_underscore'] + '.xml')}")
             
-        except Exception as e:
-            print(f'Uncaught error in {j}: {name}\n{e}')
-            skipped += 1
-        print(f'Processed {j}: {name}')
+            except Exception as e:
+                print(f'Uncaught error in {j}: {name}\n{e}')
+                failures.append(dict(index=j, name=name, kind='error', message=str(e)))
+                skipped += 1
+            print(f'Processed {j}: {name}')
+
+    for rname, path, error in writer.failures:
+        print(f'Unable to write {path}: {error}')
+        if rname is None:
+            # The macros and r_load_matrix.xml belong to no function, there is no tool to skip
+            failures.append(dict(name=os.path.basename(path), kind='write', message=f'{path}: {error}'))
+            continue
+        failures.append(dict(rname=rname, kind='write', message=f'{path}: {error}'))
+        manifest.record(rname, None, None)
+        created -= 1
+        skipped += 1
 
+    if archive is None:
+        # Drop the tools of functions that are no longer in the package
+        for path in manifest.remove_stale(digests):
+            print(f"Removed: {path}")
+        manifest.save()
+
+    created += int(create_load_matrix_tool)
     print('')
-    print(f'Created {len(package_dict) + int(args.create_load_matrix_tool)} tool XMLs')
+    print(f'Created {created} tool XMLs')
+    print(f'Unchanged {len(unchanged)} tool XMLs')
     print(f'Skipped {skipped} functions')
+    if written_bytes:
+        print(f'Wrote {written_bytes / 1024:.1f} KB of tool XML, {macro_saved_bytes / 1024:.1f} KB '
+              f'({100.0 * macro_saved_bytes / (written_bytes + macro_saved_bytes):.1f}%) less than without the '
+              f'input and ellipsis macros')
+    if failures:
+        print(f"Failed {len(failures)} functions: " + ', '.join(
+            f"{failure['kind']} {failure.get('name') or failure.get('rname')}" for failure in failures))
+    return dict(r_name=r_name, created=created, unchanged=len(unchanged), skipped=skipped, failures=failures)
+
+
+# Configfile fragments of the input types that do not depend on quoting
+RSCRIPT_ARGUMENTS = {
+    'dataset': rscript_argument_dataset,
+    'not_determined': rscript_argument_not_determined,
+}
+
+# Input templates and quoting of the types inferred from Rd argument descriptions, matching the
+# configfile fragment generate_r_script writes for the type
+INFERRED_INPUTS = {
+    'dataset': (optional_input_dataset, False),
+    'text': (optional_input_text, True),
+    'integer': (optional_input_integer, False),
+    'float': (optional_input_float, False),
+    'boolean': (optional_input_boolean, False),
+}
+
+# Shared with forked workers, which inherit it together with the warm R heap
+_WORKER_CONTEXT = {}
 
 
-def process_function(package_obj, rname, package_name, r_name, galaxy_tool_version):
-    """Process a single R function and generate the XML dictionary for it."""
+def process_name(package_importr, name, package_name, r_name, galaxy_tool_version, help_provider=None, 
+                 signatures=None, s3_methods=None, s4_methods=None):
+    """
+    Look up a binding of the imported package and process it into an XML dictionary.
+    
+    S4 methods are named by their alias in s4_methods, which maps it to the binding and rname of 
+    their generic; their tool calls the generic, which dispatches on the classes of the arguments.
+    """
+    s4_method = s4_methods.get(name) if s4_methods else None
+    if s4_method is not None:
+        binding, call = s4_method
+        package_obj = getattr(package_importr, binding)
+        rname = name
+    else:
+        package_obj = getattr(package_importr, name)
+        rname = call = package_obj.__rname__
+    
+    # Skip functions with dots in their names if needed
+    if '.' in rname and False:  # Currently disabled with False
+        print(f"Skipping: {rname}")
+        return rname, None
+        
+    # Create the XML dictionary
+    formals = signatures.get(rname) if signatures else None
+    methods = s3_methods.get(rname) if s3_methods else None
+    with tracing.span(rname, category='function'), memory.measure(r_name, rname):
+        if help_provider is None:
+            help_provider = PagesHelpProvider()
+        # Undocumented S4 methods get the help of their generic
+        help_alias = rname if call == rname or help_provider.topic(rname) is not None else call
+        return rname, process_function(package_obj, rname, package_name, r_name, galaxy_tool_version, 
+                                       help_provider=help_provider, formals=formals, methods=methods, 
+                                       call=call, help_alias=help_alias)
+
+
+def _process_name_task(task):
+    """
+    Worker entry point; errors are returned as (kind, message) so a single function cannot stop the run. 
+    
+    Trace events and memory rows recorded by a worker process are returned to the parent with the result.
+    """
+    j, name = task
+    try:
+        rname, xml_dict = process_name(_WORKER_CONTEXT['package_importr'], name, **_WORKER_CONTEXT['kwargs'])
+        error = None
+    except Exception as e:
+        rname, xml_dict, error = None, None, ('error', str(e))
+    events = (tracing.drain(), memory.drain()) if os.getpid() != _WORKER_CONTEXT['pid'] else ([], [])
+    return j, name, rname, xml_dict, error, events
+
+
+def _init_worker():
+    # Forget the parent's trace events and memory rows, inherited by fork
+    tracing.drain()
+    memory.drain()
+
+
+def _isolated_task(task, sender):
+    _init_worker()
+    sender.send(_process_name_task(task))
+    sender.close()
+
+
+def iter_isolated_functions(tasks, jobs=1, timeout=None):
+    """
+    Yield the results of tasks, each processed in its own forked worker, in the order of tasks.
+    
+    Up to jobs workers run at once. A worker that does not answer within timeout seconds is killed 
+    and reported as a 'timeout' error; one that dies, e.g. in a segfault of R, as a 'crash'. Closing 
+    the generator kills the workers still running.
+    """
+    context = multiprocessing.get_context('fork')
+    pending = list(reversed(tasks))
+    running = {}
+    done = {}
+    next_task = 0
+    try:
+        while next_task < len(tasks):
+            while pending and len(running) < jobs:
+                task = pending.pop()
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(target=_isolated_task, args=(task, sender), daemon=True)
+                process.start()
+                # Only the worker holds the sending end, so its death is seen as EOF
+                sender.close()
+                deadline = time.monotonic() + timeout if timeout else None
+                running[receiver] = (task, process, deadline)
+
+            wait_for = None
+            if timeout:
+                wait_for = max(0, min(deadline for task, process, deadline in running.values()) - time.monotonic())
+            for receiver in wait(list(running), wait_for):
+                (j, name), process, deadline = running.pop(receiver)
+                try:
+                    done[j] = receiver.recv()
+                except EOFError:
+                    process.join()
+                    done[j] = (j, name, None, None, ('crash', f'worker {describe_exitcode(process.exitcode)}'), ([], []))
+                receiver.close()
+                process.join()
+
+            now = time.monotonic()
+            for receiver, ((j, name), process, deadline) in list(running.items()):
+                if deadline is not None and now >= deadline:
+                    process.kill()
+                    process.join()
+                    receiver.close()
+                    del running[receiver]
+                    done[j] = (j, name, None, None, ('timeout', f'no result after {timeout:g} seconds'), ([], []))
+
+            while next_task < len(tasks) and tasks[next_task][0] in done:
+                yield done.pop(tasks[next_task][0])
+                next_task += 1
+    finally:
+        # Closed early, e.g. after an error in the caller: do not leave workers running
+        for receiver, (task, process, deadline) in running.items():
+            process.kill()
+            process.join()
+            receiver.close()
+
+
+def iter_processed_functions(package_importr, tasks, package_name, r_name, galaxy_tool_version, jobs=1, 
+                             help_provider=None, signatures=None, s3_methods=None, s4_methods=None, isolate=False, 
+                             timeout=None):
+    """
+    Return an iterator of (index, name, rname, xml_dict, error, (trace_events, memory_rows)) for every 
+    (index, name) task, in the order of tasks; error is None or a (kind, message) tuple.
+    
+    With jobs > 1 the work is spread over forked worker processes; results are merged back 
+    in input order so the output is identical to a serial run. The workers are forked by this call, 
+    before any writer thread is started; close the iterator to stop them. With isolate, or a timeout, 
+    every function gets a worker of its own, so that a hang or a crash only loses that function.
+    """
+    _WORKER_CONTEXT['package_importr'] = package_importr
+    _WORKER_CONTEXT['pid'] = os.getpid()
+    _WORKER_CONTEXT['kwargs'] = dict(package_name=package_name, r_name=r_name, 
+                                     galaxy_tool_version=galaxy_tool_version, help_provider=help_provider, 
+                                     signatures=signatures, s3_methods=s3_methods, s4_methods=s4_methods)
+    if (isolate or timeout) and tasks:
+        return iter_isolated_functions(tasks, jobs=jobs, timeout=timeout)
+    if jobs <= 1 or not tasks:
+        return (_process_name_task(task) for task in tasks)
+    # Fork so that workers share the already imported package instead of re-initialising R
+    pool = multiprocessing.get_context('fork').Pool(jobs, initializer=_init_worker)
+    return iter_pool_results(pool, tasks, max_pending=2 * jobs)
+
+
+def iter_pool_results(pool, tasks, max_pending):
+    """
+    Yield the results of tasks processed by pool, in the order of tasks, then terminate the pool.
+    
+    At most max_pending tasks are submitted and not yet yielded, so results do not pile up in 
+    memory while the consumer, e.g. a full writer queue, falls behind.
+    """
+    remaining = iter(tasks)
+    pending = collections.deque(pool.apply_async(_process_name_task, (task,)) 
+                                for task in itertools.islice(remaining, max_pending))
+    try:
+        while pending:
+            result = pending.popleft().get()
+            for task in itertools.islice(remaining, 1):
+                pending.append(pool.apply_async(_process_name_task, (task,)))
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def process_function(package_obj, rname, package_name, r_name, galaxy_tool_version, help_provider=None, 
+                     formals=None, methods=None, call=None, help_alias=None):
+    """
+    Process a single R function and generate the XML dictionary for it.
+    
+    The generated script calls call, by default rname, and the help is that of help_alias, by default rname.
+    """
+    call = call or rname
+    help_alias = help_alias or rname
     xml_dict = {
         'package_name': package_name,
         'id': f"{package_name}_{rname}",
@@ -121,43 +620,59 @@ def process_function(package_obj, rname, package_name, r_name, galaxy_tool_versi
     xml_dict['id'] = simplify_text(xml_dict['id'])  # ToolShed doesn't like e.g. '-' in ids
     
     # Get help documentation
-    help = pages(rname)
-    try:
-        join_char = ""
-        for i, help_page in enumerate(help):
-            xml_dict['help_rst'] = join_char.join([xml_dict['help_rst'], to_docstring(help_page)])
-            join_char = "\n\n"
-            if 'title' in list(help_page.sections.keys()) and not xml_dict['description']:
-                xml_dict['description'] = unroll_vector_to_text(help_page.sections['title'])
-        if i > 1:
-            print(f"{rname} had multiple pages: {i}, {tuple(help)}")
-    except Exception as e:
-        print(f"Falling back to docstring: {rname}, {e}")
-        xml_dict['help_rst'] = package_obj.__doc__
+    if help_provider is None:
+        help_provider = PagesHelpProvider()
+    with tracing.span('help'):
+        xml_dict['help_rst'], xml_dict['description'] = help_provider.help(help_alias, package_obj)
+    if methods:
+        # S3 methods do not get tools of their own, list them with their generic
+        xml_dict['help_rst'] = f"{xml_dict['help_rst']}\n\nS3 Methods\n----------\n\n::\n\n  {', '.join(methods)}"
     
     # Process function parameters
-    inputs, input_names = process_function_params(package_obj)
+    with tracing.span('formals'):
+        inputs, input_names, xml_dict['macro_saved_bytes'] = process_function_params(
+            package_obj, formals=formals, arguments=help_provider.arguments(help_alias))
     xml_dict['inputs'] = "        %s" % ("\n        ".join(inputs))
     
     # Generate the R script content
-    xml_dict['rscript_content'] = generate_r_script(rname, r_name, input_names)
+    with tracing.span('rscript'):
+        xml_dict['rscript_content'] = generate_r_script(call, r_name, input_names)
+    xml_dict['macro_saved_bytes'] += sum(len(rscript_ellipsis) - len(rscript_ellipsis_expand) 
+                                         for input_name in input_names if input_name[2] == 'ellipsis')
     
     return xml_dict
 
 
-def process_function_params(package_obj):
-    """Process the parameters of an R function."""
+def macro_selects(input_dict):
+    """Return the attributes that set the type selections of input_dict on a not determined or ellipsis macro."""
+    return ''.join(f' {select}="True"' for select in NOT_DETERMINED_SELECTS if input_dict[select])
+
+
+def process_function_params(package_obj, formals=None, arguments=None):
+    """
+    Process the parameters of an R function.
+    
+    formals is the list of Formal records of the function; when None they are read from package_obj.
+    arguments maps formal names to their Rd descriptions, used to type formals without a value default.
+    Returns the inputs XML, the input names and the number of bytes saved by expanding macros instead
+    of inlining their inputs.
+    """
     inputs = []
     input_names = []
+    macro_saved_bytes = 0
+    
+    if formals is None:
+        formals = formals_from_function(package_obj)
     
-    for i, (formal_name, formal_value) in enumerate(package_obj.formals().items()):
+    for i, formal in enumerate(formals):
+        formal_name = formal.name
         default_value = ''
         input_type = 'text'
         input_dict = INPUT_NOT_DETERMINED_DICT.copy()
         input_dict.update({
             'name': simplify_text(formal_name),
             'label': quoteattr(formal_name),
-            'help': quoteattr(str(formal_value).strip()),
+            'help': quoteattr(formal.help),
             'value': '',
             'multiple': False,
         })
@@ -165,22 +680,20 @@ def process_function_params(package_obj):
         input_template = optional_input_text
         use_quotes = True
         
-        try:
-            # Extract type information from the parameter
-            value_name, value_value = list(formal_value.items())[0]
-            r_type = str_typeint(value_value.typeof)
+        if formal.r_type is not None:
+            r_type = formal.r_type
             
             # Set the appropriate input type based on R type
             if r_type == 'INTSXP':
                 input_type = 'integer'
-                default_value = str(value_value[0])
+                default_value = formal.value
                 input_template = optional_input_integer
                 use_quotes = False
                 input_dict['integer_selected'] = True
                 input_type = 'not_determined'
             elif r_type == 'LGLSXP':  # This seems to have caught NA...FIXME
                 input_type = 'boolean'
-                default_value = str(value_value[0])
+                default_value = formal.value
                 input_template = optional_input_boolean
                 use_quotes = False
                 if default_value == 'NULL':
@@ -192,28 +705,35 @@ def process_function_params(package_obj):
                 input_type = 'not_determined'
             elif r_type == 'REALSXP':
                 input_type = 'float'
-                default_value = str(value_value[0])
+                default_value = formal.value
                 input_template = optional_input_float
                 use_quotes = False
                 input_dict['float_selected'] = True
                 input_type = 'not_determined'
             elif r_type == 'STRSXP':
                 input_type = 'text'
-                default_value = str(value_value[0])
+                default_value = formal.value
                 input_template = optional_input_text
                 input_dict['text_selected'] = True
                 input_type = 'not_determined'
+            elif formal.choices and not any('"' in choice or '\\' in choice for choice in formal.choices):
+                # A literal c("a", "b") default, as used with match.arg: a single select of its elements
+                input_type = 'choice'
+                default_value = formal.choices[0]
             else:
-                input_type = 'not_determined'
-                input_template = optional_input_not_determined
-                input_dict['dataset_selected'] = True
+                # No value to type the formal by, unless its documentation names a single type
+                inferred_type = infer_input_type((arguments or {}).get(formal_name))
+                if inferred_type is not None:
+                    input_type = inferred_type
+                    input_template, use_quotes = INFERRED_INPUTS[inferred_type]
+                else:
+                    input_type = 'not_determined'
+                    input_template = optional_input_not_determined
+                    input_dict['dataset_selected'] = True
             
             # Handle multiple values
-            length = len(list(value_value))
-            input_dict['multiple'] = (length > 1)
-            
-        except Exception as e:
-            print(f'Error getting input param info: {e}')
+            if formal.length is not None:
+                input_dict['multiple'] = (formal.length > 1)
         
         # Final adjustments based on input type
         if input_type == 'dataset':
@@ -227,79 +747,56 @@ def process_function_params(package_obj):
         # Handle ellipsis parameter
         if formal_name in ['...']:
             print('has ... need to replace with a repeat and conditional')
-            inputs.append(ellipsis_input % input_dict)
+            # The repeat is defined once in the macros file, the tool only expands it
+            input_dict['selects'] = macro_selects(input_dict)
+            inputs.append(ellipsis_input_expand % input_dict)
+            macro_saved_bytes += len(ellipsis_input % input_dict) - len(inputs[-1])
             input_names.append(('...', '___ellipsis___', 'ellipsis', False))
+        elif input_template is optional_input_not_determined:
+            # The conditional is defined once in the macros file, the tool only expands it
+            input_dict['selects'] = macro_selects(input_dict)
+            inputs.append(optional_input_not_determined_expand % input_dict)
+            macro_saved_bytes += len(optional_input_not_determined % input_dict) - len(inputs[-1])
+            input_names.append((formal_name, input_place_name, input_type, use_quotes))
+        elif input_type == 'choice':
+            input_dict['options'] = ''.join(
+                input_choice_option % dict(value=quoteattr(choice), text=escape(choice), 
+                                           selected=' selected="true"' if k == 0 else '')
+                for k, choice in enumerate(formal.choices))
+            inputs.append(input_choice % input_dict)
+            input_names.append((formal_name, input_place_name, input_type, True))
         else:
             inputs.append(input_template % input_dict)
             input_names.append((formal_name, input_place_name, input_type, use_quotes))
     
-    return inputs, input_names
+    return inputs, input_names, macro_saved_bytes
 
 
 def generate_r_script(rname, r_name, input_names):
     """Generate the R script content for the tool."""
-    rscript_content = f'{CONFIG_SPLIT_DESIRED_OUTPUTS}\nlibrary({r_name})\n#set $___USE_COMMA___ = ""\nrval <- {rname}('
+    # Collect the fragments and join them once, instead of copying the script for every formal
+    fragments = [f'{CONFIG_SPLIT_DESIRED_OUTPUTS}\nlibrary({r_name})\n#set $___USE_COMMA___ = ""\nrval <- {rname}(']
     
-    for i, (inp_name, input_placeholder, input_type, use_quotes) in enumerate(input_names):
+    for inp_name, input_placeholder, input_type, use_quotes in input_names:
         if input_type == 'ellipsis':
-            rscript_content = f'''{rscript_content}${{___USE_COMMA___}}
-                                #set $___USE_COMMA___ = ","
-                                #for eli in $___ellipsis___:
-                                    #if str( $eli.argument_type.argument_type_selector ) != 'skip':
-                                         #set $___USE_COMMA___ = ","\n
-                                         #if str( $eli.argument_type.argument_type_selector ) == 'dataset':
-                                             ${{eli.argument_name}} = readRDS("${{eli.argument_type.argument}}")
-                                         #elif str( $eli.argument_type.argument_type_selector ) == 'text':
-                                             ${{eli.argument_name}} = "${{eli.argument_type.argument}}"
-                                         #elif str( $eli.argument_type.argument_type_selector ) == 'integer':
-                                             ${{eli.argument_name}} = ${{eli.argument_type.argument}}
-                                         #elif str( $eli.argument_type.argument_type_selector ) == 'float':
-                                             ${{eli.argument_name}} = ${{eli.argument_type.argument}}
-                                         #elif str( $eli.argument_type.argument_type_selector ) == 'boolean':
-                                             ${{eli.argument_name}} = ${{eli.argument_type.argument}}
-                                         #elif str( $eli.argument_type.argument_type_selector ) == 'select':
-                                             #raise ValueError( 'not implemented' )
-                                             ${{eli.argument_name}} = "${{eli.argument_type.argument}}"
-                                         #elif str( $eli.argument_type.argument_type_selector ) == 'NULL':
-                                             ${{eli.argument_name}} = NULL
-                                         #end if
-                                     #end if
-                                #end for
-                                '''
+            # Galaxy replaces the token with the dispatcher of the macros file
+            fragments.append(rscript_ellipsis_expand)
+            continue
+        if input_type == 'choice':
+            # Not wrapped in rscript_selected: the select always has a value
+            fragments.append(rscript_argument_choice % dict(name=inp_name, placeholder=input_placeholder))
+            continue
+        if input_type in RSCRIPT_ARGUMENTS:
+            argument = RSCRIPT_ARGUMENTS[input_type]
+        elif use_quotes:
+            argument = rscript_argument_quoted
         else:
-            rscript_content = f'{rscript_content}\n#if str( ${input_placeholder}_type.{input_placeholder}_type_selector ) == "True":\n'
-            if input_type == 'dataset':
-                rscript_content = f'{rscript_content}${{___USE_COMMA___}}\n#set $___USE_COMMA___ = ","\n{inp_name} = readRDS("${{input_{input_placeholder}}}")'
-            elif input_type == 'not_determined':
-                rscript_content = f'''{rscript_content}${{___USE_COMMA___}}
-                                     #if str( ${input_placeholder}_type.{input_placeholder}_type.{input_placeholder}_type_selector ) != 'skip':
-                                         #set $___USE_COMMA___ = ","\n
-                                         #if str( ${input_placeholder}_type.{input_placeholder}_type.{input_placeholder}_type_selector ) == 'dataset':
-                                             {inp_name} = readRDS("${{{input_placeholder}_type.{input_placeholder}_type.{input_placeholder}}}")
-                                         #elif str( ${input_placeholder}_type.{input_placeholder}_type.{input_placeholder}_type_selector ) == 'text':
-                                             {inp_name} = "${{ {input_placeholder}_type.{input_placeholder}_type.{input_placeholder} }}"
-                                         #elif str( ${input_placeholder}_type.{input_placeholder}_type.{input_placeholder}_type_selector ) == 'integer':
-                                             {inp_name} = ${{ {input_placeholder}_type.{input_placeholder}_type.{input_placeholder} }}
-                                         #elif str( ${input_placeholder}_type.{input_placeholder}_type.{input_placeholder}_type_selector ) == 'float':
-                                             {inp_name} = ${{ {input_placeholder}_type.{input_placeholder}_type.{input_placeholder} }}
-                                         #elif str( ${input_placeholder}_type.{input_placeholder}_type.{input_placeholder}_type_selector ) == 'boolean':
-                                             {inp_name} = ${{ {input_placeholder}_type.{input_placeholder}_type.{input_placeholder} }}
-                                         #elif str( ${input_placeholder}_type.{input_placeholder}_type.{input_placeholder}_type_selector ) == 'select':
-                                             #raise ValueError( 'not implemented' )
-                                             {inp_name} = "${{ {input_placeholder}_type.{input_placeholder}_type.{input_placeholder} }}"
-                                         #elif str( ${input_placeholder}_type.{input_placeholder}_type.{input_placeholder}_type_selector ) == 'NULL':
-                                             {inp_name} = NULL
-                                         #end if
-                                     #end if
-                                     '''
-            elif use_quotes:
-                rscript_content = f'{rscript_content}${{___USE_COMMA___}}\n#set $___USE_COMMA___ = ","\n{inp_name} = "${{ {input_placeholder}_type.{input_placeholder} }}"'
-            else:
-                rscript_content = f'{rscript_content}${{___USE_COMMA___}}\n#set $___USE_COMMA___ = ","\n{inp_name} = ${{ {input_placeholder}_type.{input_placeholder} }}'
-            rscript_content = f'{rscript_content}\n#end if\n'
+            argument = rscript_argument
+        names = dict(name=inp_name, placeholder=input_placeholder)
+        fragments.extend((rscript_selected % names, argument % names, rscript_end))
     
-    rscript_content = f'{rscript_content}\n){SAVE_R_OBJECT_TEXT}'
-    return rscript_content
+    fragments.append(f'\n){SAVE_R_OBJECT_TEXT}')
+    return ''.join(fragments)
 
 
 if __name__ == "__main__":
@@ -1,36 +1,47 @@
 import argparse
+import collections
+import contextlib
+import io
+import json
+import multiprocessing
 import subprocess
 import tempfile
 import os, sys
 import shutil
-from r2g2.core import TOOL_TEMPLATE
-from r2g2.dependency_generator import  return_galax_tag, detect_package_channel
+from r2g2.cache import open_cache
+from r2g2.parsers.r_worker import RWorker
+from r2g2.utils import describe_exitcode
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
 import time 
+import traceback
+from multiprocessing.connection import wait
 
-#TBD: temparily anvio import, in the future will be replace by the independant anvio package 
-from r2g2.anvio import format_help, galaxy_tool_citation
-from jinja2 import Template
-
-from r2g2.parsers.r_parser import (
-    edit_r_script,
-    json_to_python,
-    return_dependencies,
-    json_to_python_for_param_info,
-    extract_simple_parser_info,
-    #TBD: R's logical type need be handled correctly while building galaxy input params. 
-    logical, 
-    pretty_xml, 
-    output_param_generator_from_argparse
-)
+# The tool generation modules (jinja2, requests, rpy2) are imported in main, so that --help and
+# argument errors do not wait for them
 
 def generate_galaxy_xml(xml_str):
     
     xml_str = ET.tostring(xml_str, encoding="unicode")
     return minidom.parseString(xml_str).toprettyxml(indent="  ")
 
-def main(r_script, out_dir, profile, dep_info, description, tool_version, citation_doi, user_define_output_param=False, user_define_input_param=None):
+def main(r_script, out_dir, profile, dep_info, description, tool_version, citation_doi, user_define_output_param=False, user_define_input_param=None, cache=None, r_worker=None):
+    from r2g2.core import TOOL_TEMPLATE
+    from r2g2.dependency_generator import  return_galax_tag, detect_package_channel
+
+    #TBD: temparily anvio import, in the future will be replace by the independant anvio package 
+    from r2g2.anvio import format_help, galaxy_tool_citation
+    from jinja2 import Template
+
+    from r2g2.parsers.r_parser import (
+        edit_r_script,
+        worker_r_script,
+        load_parsers,
+        return_dependencies,
+        extract_simple_parser_info,
+        pretty_xml, 
+        output_param_generator_from_argparse
+    )
 
     if not citation_doi:
         citation_doi = ''
@@ -38,7 +49,7 @@ def main(r_script, out_dir, profile, dep_info, description, tool_version, citati
     if not description:
         description = r_script.split('/')[len(r_script.split('/'))-1].split('.')[0] + " tool"
 
-    dependency_tag = "\n".join([return_galax_tag(*detect_package_channel(i), False) for i in return_dependencies(r_script)])
+    dependency_tag = "\n".join([return_galax_tag(*detect_package_channel(i), False) for i in return_dependencies(r_script, cache=cache)])
 
     current_dir = os.getcwd()
     temp_dir = tempfile.mkdtemp(dir=current_dir)
@@ -52,21 +63,30 @@ def main(r_script, out_dir, profile, dep_info, description, tool_version, citati
         if not os.path.exists(out_dir_path):
             os.makedirs(out_dir_path)
             
-        edited_r_script  = os.path.join(temp_dir, "%s_edited.r"%(r_script.split('/')[len(r_script.split('/'))-1].split('.')[0])) 
-        
-        print("####################################################################")
-        print("R script with argument parsing edited and processed successfully...")
-        print("####################################################################")
+        if r_worker is not None:
+            # The worker already has FakeArg.r loaded, it only runs the script's parser
+            arguments = r_worker.extract(worker_r_script(r_script))
+        else:
+            edited_r_script  = os.path.join(temp_dir, "%s_edited.r"%(r_script.split('/')[len(r_script.split('/'))-1].split('.')[0])) 
+            json_out  = os.path.join(temp_dir, "%s.json"%(r_script.split('/')[len(r_script.split('/'))-1].split('.')[0]))  
 
-        json_out  = os.path.join(temp_dir, "%s.json"%(r_script.split('/')[len(r_script.split('/'))-1].split('.')[0]))  
+            edit_r_script(r_script, edited_r_script, json_file_name=json_out )
 
-        print("####################################################################")
-        print("Extracted arguments have been written to a JSON file successfully...")  
-        print("####################################################################")
-    
-        edit_r_script(r_script, edited_r_script, json_file_name=json_out )
+            print("####################################################################")
+            print("R script with argument parsing edited and processed successfully...")
+            print("####################################################################")
 
-        subprocess.run(['Rscript',  edited_r_script])
+            # Printed rather than inherited, so that it is captured with the rest of a worker's output
+            completed = subprocess.run(['Rscript',  edited_r_script], capture_output=True, text=True)
+            print(completed.stdout, end='')
+            print(completed.stderr, end='')
+
+            print("####################################################################")
+            print("Extracted arguments have been written to a JSON file successfully...")  
+            print("####################################################################")
+
+            with open(json_out) as fh:
+                arguments = json.load(fh)
 
         data_params_list = None
         if user_define_input_param:
@@ -96,32 +116,19 @@ def main(r_script, out_dir, profile, dep_info, description, tool_version, citati
             # output_command  = "\t\t\t\t\t".join(list(set([i.to_cmd_line() for i in  blankenberg_parameters.oynaxraoret_to_outputs(params)])))
             pass
 
-        python_code_as_string = json_to_python(json_out, data_params=data_params_list, ignore_params=output_args_list)
-        param_info_dict = {}
-        argument_string = json_to_python_for_param_info(json_out)
-        argument_string.replace('logical', 'boolean')
-
-        exec(argument_string, globals(), param_info_dict)
-
-        param_info = param_info_dict.get('param_info')
+        # Built from the argument strings directly, without generating and executing Python code
+        blankenberg_parameters, param_info = load_parsers(arguments, data_params=data_params_list, 
+                                                          ignore_params=output_args_list)
 
         print("####################################################################")
         print("Converted R arguments to Python argparse successfully...")
         print("####################################################################")
 
-        input = python_code_as_string
         params = {}
-        __provides__ = [] # Reset provides since it is not always declared
-        local_dict={}
-        global_dict={}
-        local_dict = {}
-
-        exec(input, globals(), local_dict)
 
         combined_xml = []
         combined_command = []
 
-        blankenberg_parameters = local_dict.get('blankenberg_parameters')
         blankenberg_parameters.param_cat = extract_simple_parser_info(param_info)
 
         flat_param, flat_command = blankenberg_parameters.flat_param_groups(blankenberg_parameters.param_cat )
@@ -215,6 +222,127 @@ def main(r_script, out_dir, profile, dep_info, description, tool_version, citati
             print(f"Directory does not exist: {temp_dir}")
 
 
+# Per-process state of the --jobs workers, which open their own cache connection and R worker
+_WORKER_CONTEXT = {}
+
+
+def process_script(r_script, options, cache=None, r_worker=None, capture=False):
+    """
+    Generate the tool of one R script, returning (error, elapsed seconds, output).
+
+    Errors are returned as text, with their traceback in the output, so that one script cannot stop a
+    batch; with capture, what the script prints is returned as output instead of being printed.
+    """
+    start = time.time()
+    output = io.StringIO()
+    error = None
+    with contextlib.redirect_stdout(output) if capture else contextlib.nullcontext():
+        try:
+            main(r_script, cache=cache, r_worker=r_worker, **options)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            print(traceback.format_exc())
+    return error, time.time() - start, output.getvalue()
+
+
+def _init_worker(cache_path, no_cache, use_r_worker):
+    _WORKER_CONTEXT['cache'] = None if no_cache else open_cache(cache_path)
+    _WORKER_CONTEXT['r_worker'] = RWorker() if use_r_worker else None
+
+
+def _script_worker(connection, cache_path, no_cache, use_r_worker):
+    """Process the (r_script, options) tasks received on connection until it receives None."""
+    _init_worker(cache_path, no_cache, use_r_worker)
+    try:
+        while True:
+            try:
+                task = connection.recv()
+            except EOFError:
+                break
+            if task is None:
+                break
+            r_script, options = task
+            connection.send(process_script(r_script, options, cache=_WORKER_CONTEXT['cache'], 
+                                           r_worker=_WORKER_CONTEXT['r_worker'], capture=True))
+    finally:
+        if _WORKER_CONTEXT['r_worker'] is not None:
+            _WORKER_CONTEXT['r_worker'].close()
+        if _WORKER_CONTEXT['cache']:
+            _WORKER_CONTEXT['cache'].close()
+        connection.close()
+
+
+def iter_processed_scripts(r_scripts, options, jobs=1, cache_path=None, no_cache=False, use_r_worker=True):
+    """
+    Yield (error, elapsed seconds, output) for every script, in the order of r_scripts.
+
+    With jobs > 1 the scripts are spread over forked worker processes, each with its own cache
+    connection, R worker and temporary directories; their output is captured and yielded in input
+    order, so that a parallel run prints and writes the same as a serial one. A worker that dies,
+    e.g. in a segfault of R, fails its script and is replaced; closing the generator stops the workers.
+    """
+    if jobs <= 1:
+        cache = None if no_cache else open_cache(cache_path)
+        r_worker = RWorker() if use_r_worker else None
+        try:
+            for r_script in r_scripts:
+                yield process_script(r_script, options, cache=cache, r_worker=r_worker)
+        finally:
+            if r_worker is not None:
+                r_worker.close()
+            if cache:
+                cache.close()
+        return
+    context = multiprocessing.get_context('fork')
+    pending = collections.deque(range(len(r_scripts)))
+    workers = {}
+    idle = []
+    busy = {}
+    done = {}
+    next_index = 0
+    try:
+        while next_index < len(r_scripts):
+            while pending and len(busy) < jobs:
+                if idle:
+                    connection = idle.pop()
+                else:
+                    connection, worker_end = context.Pipe()
+                    process = context.Process(target=_script_worker, daemon=True, 
+                                              args=(worker_end, cache_path, no_cache, use_r_worker))
+                    process.start()
+                    # Only the worker holds its end, so its death is seen as EOF
+                    worker_end.close()
+                    workers[connection] = process
+                index = pending.popleft()
+                connection.send((r_scripts[index], options))
+                busy[connection] = (index, time.time())
+
+            for connection in wait(list(busy)):
+                index, start = busy.pop(connection)
+                try:
+                    done[index] = connection.recv()
+                    idle.append(connection)
+                except EOFError:
+                    process = workers.pop(connection)
+                    process.join()
+                    connection.close()
+                    done[index] = (f"worker {describe_exitcode(process.exitcode)}", time.time() - start, '')
+
+            while next_index in done:
+                yield done.pop(next_index)
+                next_index += 1
+    finally:
+        for connection, process in workers.items():
+            # Later workers inherit the parent's end of every earlier pipe, so closing it is not seen as
+            # EOF; idle workers are told to stop instead, busy ones are killed
+            if connection in busy:
+                process.kill()
+            else:
+                connection.send(None)
+            process.join()
+            connection.close()
+
+
 def run_main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-r', '--r_script_name', required=False, default=None, help="Provide the path of an R script... ")
@@ -227,6 +355,11 @@ def run_main():
     parser.add_argument('-c', '--citation_doi', required=False,  default=None, help="Comma separated Citation DOI.")
     parser.add_argument('-u', '--user_define_output_param', required=False, default=False, help="Rather guessing output params, user can define output params in specific format. Ex. 'name:protein,format:pdb,label:protein file,from_work_directory;name:ligand,format:pdb,label:ligand file,from_work_directory'")
     parser.add_argument('-i', '--user_define_input_param', required=False, default=None, help="List of input parameters to be treated as data inputs, comma separated. Ex. 'input_file,reference_data'")
+    parser.add_argument('--cache', required=False, default=None, help="Path of the SQLite introspection cache (default: $R2G2_CACHE or ~/.cache/r2g2)")
+    parser.add_argument('--no_cache', required=False, action='store_true', help="Do not read or write the introspection cache")
+    parser.add_argument('--no_r_worker', required=False, action='store_true', help="Run a new Rscript per script instead of one R worker for the batch")
+    parser.add_argument('-j', '--jobs', required=False, type=int, default=1, help="Number of scripts to process in parallel worker processes")
+    parser.add_argument('--max_failures', required=False, type=int, default=0, help="Number of failed scripts tolerated before exiting with a non-zero status")
 
     args = parser.parse_args()
 
@@ -234,6 +367,8 @@ def run_main():
         print("\n\nPlease provide either a single Rscript or a text file containing paths to R scripts. See the details below...\n\n")
         parser.print_help() 
         sys.exit(1)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
         
     if args.r_scripts:
         file = open(args.r_scripts)
@@ -242,25 +377,45 @@ def run_main():
         r_scrtips_list = [args.r_script_name]
 
     total_files = len(r_scrtips_list)
+    options = dict(out_dir=args.output_dir, profile=args.profile, dep_info=args.dependencies, 
+                   description=args.description, tool_version=args.tool_version, citation_doi=args.citation_doi, 
+                   user_define_output_param=args.user_define_output_param, 
+                   user_define_input_param=args.user_define_input_param)
 
     start_time = time.time()  # total processing start
 
-    for idx, r_spt in enumerate(r_scrtips_list, start=1):
-        file_start = time.time()
-        print(f"[{idx}/{total_files}] Processing: {r_spt} ...")
-
-        # try:
-        main(r_spt, args.output_dir, args.profile, args.dependencies, args.description, args.tool_version, args.citation_doi, args.user_define_output_param, args.user_define_input_param)
-        status = "Success"
-        # except Exception as e:
-        #     status = f"Failed ({e})"
-
-        file_end = time.time()
-        elapsed = file_end - file_start
-        print(f"[{idx}/{total_files}] Finished: {r_spt} | Status: {status} | Time taken: {elapsed:.2f}s\n")
+    # Workers print nothing themselves, their output is replayed here in input order
+    statuses = []
+    results = iter_processed_scripts(r_scrtips_list, options, jobs=args.jobs, cache_path=args.cache, 
+                                     no_cache=args.no_cache, use_r_worker=not args.no_r_worker)
+    try:
+        for idx, r_spt in enumerate(r_scrtips_list, start=1):
+            if args.jobs <= 1:
+                print(f"[{idx}/{total_files}] Processing: {r_spt} ...")
+            error, elapsed, output = next(results)
+            if args.jobs > 1:
+                print(f"[{idx}/{total_files}] Processing: {r_spt} ...")
+                print(output, end='')
+            status = "Success" if error is None else f"Failed ({error})"
+            statuses.append((r_spt, status, elapsed))
+            print(f"[{idx}/{total_files}] Finished: {r_spt} | Status: {status} | Time taken: {elapsed:.2f}s\n")
+    finally:
+        # Stops the R worker, closes the cache and terminates the pool of the generator
+        results.close()
 
     total_elapsed = time.time() - start_time
+    failures = sum(1 for r_spt, status, elapsed in statuses if status != "Success")
+    if total_files > 1:
+        width = max(len(r_spt) for r_spt, status, elapsed in statuses)
+        print(f"{'Script':<{width}}  {'Time (s)':>8}  Status")
+        for r_spt, status, elapsed in statuses:
+            print(f"{r_spt:<{width}}  {elapsed:>8.2f}  {status}")
+        print('')
     print(f"All files processed. Total time: {total_elapsed:.2f}s")
+    if failures:
+        print(f"{failures} of {total_files} scripts failed")
+    if failures > args.max_failures:
+        sys.exit(1)
 
 if __name__ == "__main__":
     run_main()
\ No newline at end of file
@@ -63,11 +63,20 @@ input_boolean = '''<param name="%(name)s" type="boolean" truevalue="TRUE" falsev
 input_integer = '''<param name="%(name)s" type="integer" value=%(value)s label=%(label)s help=%(help)s/>'''
 input_float = '''<param name="%(name)s" type="float" value=%(value)s label=%(label)s help=%(help)s/>'''
 input_select = '''<param name="%(name)s" type="text" value=%(value)s label=%(label)s help=%(help)s/><!-- Should be select? -->'''
+# A formal whose default is a literal character vector, e.g. c("holm", "BH"): R defaults to the first element
+input_choice = '''<param name="%(name)s" type="select" label=%(label)s help=%(help)s>%(options)s
+        </param>'''
+input_choice_option = '''
+            <option value=%(value)s%(selected)s>%(text)s</option>'''
+
+# Type selections of not determined inputs, one boolean each in the input dictionaries and passed
+# to the optional_input_not_determined and ellipsis_input macros
+NOT_DETERMINED_SELECTS = ['dataset_selected', 'text_selected', 'integer_selected', 'float_selected', 
+                          'boolean_selected', 'skip_selected', 'NULL_selected', 'NA_selected']
 
 # Dictionary for not determined inputs
 INPUT_NOT_DETERMINED_PASS_DICT = {}
-for select in ['dataset_selected', 'text_selected', 'integer_selected', 'float_selected', 
-               'boolean_selected', 'skip_selected', 'NULL_selected', 'NA_selected']:
+for select in NOT_DETERMINED_SELECTS:
     INPUT_NOT_DETERMINED_PASS_DICT[select] = "%(" + select + ")s"
 
 # Template for when input type is not determined
@@ -123,8 +132,7 @@ input_not_determined = '''
 
 # Default settings for not determined inputs
 INPUT_NOT_DETERMINED_DICT = {}
-for select in ['dataset_selected', 'text_selected', 'integer_selected', 'float_selected', 
-               'boolean_selected', 'skip_selected', 'NULL_selected', 'NA_selected']:
+for select in NOT_DETERMINED_SELECTS:
     INPUT_NOT_DETERMINED_DICT[select] = False
 
 # Template for optional inputs
@@ -173,6 +181,25 @@ optional_input_not_determined = optional_input % dict(
     ).items())
 )
 
+# optional_input_not_determined as a macro of the package macros file; name, label and help are required
+# tokens, the value defaults to empty and every type selection to False
+optional_input_not_determined_macro = '''    <xml name="optional_input_not_determined" tokens="name,label,help" token_value="" %(token_selects)s>%(body)s    </xml>
+''' % dict(
+    token_selects=' '.join('token_%s="False"' % select for select in NOT_DETERMINED_SELECTS),
+    body=optional_input_not_determined % dict(
+        list(dict((select, '@%s@' % select.upper()) for select in NOT_DETERMINED_SELECTS).items()) +
+        list(dict(
+            name='@NAME@',
+            label='"@LABEL@"',
+            help='"@HELP@"',
+            value='"@VALUE@"'
+        ).items())
+    )
+)
+
+# Expands the optional_input_not_determined macro in a tool; selects holds the selections that are not False
+optional_input_not_determined_expand = '''<expand macro="optional_input_not_determined" name="%(name)s" label=%(label)s help=%(help)s value=%(value)s%(selects)s/>'''
+
 # Template for ellipsis input (variable arguments)
 ellipsis_input = '''
     <repeat name="___ellipsis___" title="Additional %(name)s">
@@ -191,3 +218,76 @@ ellipsis_input = '''
         value='""'
     ).items())
 )
+
+
+# Cheetah fragments of the R configfile, one per input; rscript_selected and rscript_end wrap each
+# named argument, which is then passed as one of the rscript_argument_* blocks
+rscript_selected = '''\n#if str( $%(placeholder)s_type.%(placeholder)s_type_selector ) == "True":\n'''
+rscript_end = '''\n#end if\n'''
+rscript_argument_dataset = '''${___USE_COMMA___}\n#set $___USE_COMMA___ = ","\n%(name)s = readRDS("${ %(placeholder)s_type.%(placeholder)s }")'''
+rscript_argument_quoted = '''${___USE_COMMA___}\n#set $___USE_COMMA___ = ","\n%(name)s = "${ %(placeholder)s_type.%(placeholder)s }"'''
+rscript_argument = '''${___USE_COMMA___}\n#set $___USE_COMMA___ = ","\n%(name)s = ${ %(placeholder)s_type.%(placeholder)s }'''
+# Always passed, as the select has no unset state
+rscript_argument_choice = '''\n${___USE_COMMA___}\n#set $___USE_COMMA___ = ","\n%(name)s = "${ %(placeholder)s }"'''
+rscript_argument_not_determined = '''${___USE_COMMA___}
+                                     #if str( $%(placeholder)s_type.%(placeholder)s_type.%(placeholder)s_type_selector ) != 'skip':
+                                         #set $___USE_COMMA___ = ","\n
+                                         #if str( $%(placeholder)s_type.%(placeholder)s_type.%(placeholder)s_type_selector ) == 'dataset':
+                                             %(name)s = readRDS("${%(placeholder)s_type.%(placeholder)s_type.%(placeholder)s}")
+                                         #elif str( $%(placeholder)s_type.%(placeholder)s_type.%(placeholder)s_type_selector ) == 'text':
+                                             %(name)s = "${ %(placeholder)s_type.%(placeholder)s_type.%(placeholder)s }"
+                                         #elif str( $%(placeholder)s_type.%(placeholder)s_type.%(placeholder)s_type_selector ) == 'integer':
+                                             %(name)s = ${ %(placeholder)s_type.%(placeholder)s_type.%(placeholder)s }
+                                         #elif str( $%(placeholder)s_type.%(placeholder)s_type.%(placeholder)s_type_selector ) == 'float':
+                                             %(name)s = ${ %(placeholder)s_type.%(placeholder)s_type.%(placeholder)s }
+                                         #elif str( $%(placeholder)s_type.%(placeholder)s_type.%(placeholder)s_type_selector ) == 'boolean':
+                                             %(name)s = ${ %(placeholder)s_type.%(placeholder)s_type.%(placeholder)s }
+                                         #elif str( $%(placeholder)s_type.%(placeholder)s_type.%(placeholder)s_type_selector ) == 'select':
+                                             #raise ValueError( 'not implemented' )
+                                             %(name)s = "${ %(placeholder)s_type.%(placeholder)s_type.%(placeholder)s }"
+                                         #elif str( $%(placeholder)s_type.%(placeholder)s_type.%(placeholder)s_type_selector ) == 'NULL':
+                                             %(name)s = NULL
+                                         #end if
+                                     #end if
+                                     '''
+rscript_ellipsis = '''${___USE_COMMA___}
+                                #set $___USE_COMMA___ = ","
+                                #for eli in $___ellipsis___:
+                                    #if str( $eli.argument_type.argument_type_selector ) != 'skip':
+                                         #set $___USE_COMMA___ = ","\n
+                                         #if str( $eli.argument_type.argument_type_selector ) == 'dataset':
+                                             ${eli.argument_name} = readRDS("${eli.argument_type.argument}")
+                                         #elif str( $eli.argument_type.argument_type_selector ) == 'text':
+                                             ${eli.argument_name} = "${eli.argument_type.argument}"
+                                         #elif str( $eli.argument_type.argument_type_selector ) == 'integer':
+                                             ${eli.argument_name} = ${eli.argument_type.argument}
+                                         #elif str( $eli.argument_type.argument_type_selector ) == 'float':
+                                             ${eli.argument_name} = ${eli.argument_type.argument}
+                                         #elif str( $eli.argument_type.argument_type_selector ) == 'boolean':
+                                             ${eli.argument_name} = ${eli.argument_type.argument}
+                                         #elif str( $eli.argument_type.argument_type_selector ) == 'select':
+                                             #raise ValueError( 'not implemented' )
+                                             ${eli.argument_name} = "${eli.argument_type.argument}"
+                                         #elif str( $eli.argument_type.argument_type_selector ) == 'NULL':
+                                             ${eli.argument_name} = NULL
+                                         #end if
+                                     #end if
+                                #end for
+                                '''
+
+# The ellipsis dispatcher as a token of the package macros file, referenced by the configfile of every
+# function taking ...
+rscript_ellipsis_expand = '@RSCRIPT_ELLIPSIS@'
+rscript_ellipsis_token = '''    <token name="%s"><![CDATA[%s]]>
+    </token>
+''' % (rscript_ellipsis_expand, rscript_ellipsis)
+
+# ellipsis_input as a macro of the package macros file, with the type selections as tokens defaulting to False
+ellipsis_input_macro = '''    <xml name="ellipsis_input" %(token_selects)s>%(body)s    </xml>
+''' % dict(
+    token_selects=' '.join('token_%s="False"' % select for select in NOT_DETERMINED_SELECTS),
+    body=ellipsis_input % dict((select, '@%s@' % select.upper()) for select in NOT_DETERMINED_SELECTS)
+)
+
+# Expands the ellipsis_input macro in a tool; selects holds the selections that are not False
+ellipsis_input_expand = '''<expand macro="ellipsis_input"%(selects)s/>'''
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Chrome trace-event spans of a run, viewable in chrome://tracing or ui.perfetto.dev."""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Recorded events, None while tracing is disabled
+_events = None
+
+
+def enable():
+    global _events
+    if _events is None:
+        _events = []
+
+
+def enabled():
+    return _events is not None
+
+
+@contextmanager
+def span(name, category='phase', **args):
+    """Record the enclosed block as a complete event; nested spans show as its children."""
+    if _events is None:
+        yield
+        return
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        _events.append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': start / 1000.0,
+            'dur': (time.perf_counter_ns() - start) / 1000.0,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args,
+        })
+
+
+def drain():
+    """Return and forget the events recorded so far, e.g. to send them from a worker to its parent."""
+    if _events is None:
+        return []
+    events = list(_events)
+    del _events[:]
+    return events
+
+
+def extend(events):
+    if _events is not None:
+        _events.extend(events)
+
+
+def write(path):
+    """Write the recorded events as a trace-event JSON file, naming the main and worker processes."""
+    main_pid = os.getpid()
+    pids = sorted(set(event['pid'] for event in _events or []) | set([main_pid]))
+    metadata = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                 'args': {'name': 'r2g2' if pid == main_pid else f'worker {pid}'}} for pid in pids]
+    with open(path, 'w') as out:
+        json.dump({'traceEvents': metadata + (_events or []), 'displayTimeUnit': 'ms'}, out)
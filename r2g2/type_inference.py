@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Infer the Galaxy input type of a formal from its description in the Rd \\arguments section."""
+
+import re
+
+# Rd markup of argument descriptions, e.g. \code{x}, \link[pkg]{fun}, \sQuote{a}
+RD_MARKUP = re.compile(r'\\[a-zA-Z]+(\[[^\]]*\])?')
+RD_BRACES = re.compile(r'[{}]')
+WHITESPACE = re.compile(r'\s+')
+
+# Patterns matched against the start of a description, in order of precedence; a description is
+# only typed when it opens with one of them, so that "logical; if TRUE ..." is a boolean but
+# "the number of ... of the data frame" is left alone
+ARTICLE = r'^(an?\s+|the\s+|optional(ly)?[:,]?\s+|single\s+|one\s+|length[- ]one\s+|scalar\s+)*'
+LEADING_PATTERNS = [
+    ('dataset', re.compile(ARTICLE + r'((numeric|integer|logical|character|complex|real|numerical)\s+)?'
+                           r'(data[ .]?frames?|matrix|matrices|vectors?|arrays?|lists?|tables?|factors?|'
+                           r'time[ -]series|(fitted\s+)?(model\s+)?objects?)\b', re.I)),
+    ('boolean', re.compile(ARTICLE + r'(logical|boolean)\b(?!\s+(vector|matrix|array))', re.I)),
+    ('integer', re.compile(ARTICLE + r'((positive|non-?negative|strictly\s+positive)\s+)?'
+                           r'(integer|whole\s+number|number\s+of)\b(?!\s+(vector|matrix|array))', re.I)),
+    ('float', re.compile(ARTICLE + r'((positive|non-?negative)\s+)?(numeric|number|real|double|numerical)\b'
+                         r'(?!\s+(vector|matrix|array|of))', re.I)),
+    ('text', re.compile(ARTICLE + r'(character(\s+string)?|string|file\s*name|name\s+of|path\s+to)\b'
+                        r'(?!\s+(vector|matrix|array))', re.I)),
+]
+
+# Phrases that contradict a single value of the leading type, e.g. "numeric or character"
+AMBIGUOUS = re.compile(r'\b(or\s+(a\s+)?(numeric|character|logical|integer|function|list|vector|matrix|'
+                       r'data[ .]?frame|NULL)|either|function)\b', re.I)
+
+
+def clean_rd_text(text):
+    """Reduce the Rd markup of an argument description to plain words."""
+    return WHITESPACE.sub(' ', RD_BRACES.sub('', RD_MARKUP.sub('', text))).strip()
+
+
+def infer_input_type(description):
+    """
+    Return the input type ('dataset', 'boolean', 'integer', 'float' or 'text') described by an
+    argument description, or None when the description does not clearly name a single type.
+    """
+    if not description:
+        return None
+    text = clean_rd_text(description)
+    if AMBIGUOUS.search(text):
+        return None
+    matches = [input_type for input_type, pattern in LEADING_PATTERNS if pattern.match(text)]
+    if len(matches) != 1:
+        return None
+    return matches[0]
@@ -4,10 +4,20 @@
 """Utility functions for R2G2."""
 
 import os
+import signal
 import string
 
 SAFE_CHARS = list(x for x in string.ascii_letters + string.digits + '_')
 
+def describe_exitcode(exitcode):
+    """Describe how a worker process ended, e.g. 'killed by SIGSEGV'."""
+    if exitcode is not None and exitcode < 0:
+        try:
+            return f'killed by {signal.Signals(-exitcode).name}'
+        except ValueError:
+            return f'killed by signal {-exitcode}'
+    return f'exited with status {exitcode}'
+
 def simplify_text(text):
     """Replace special characters with underscores for safe filenames and ids."""
     return ''.join([x if x in SAFE_CHARS else '_' for x in text])
@@ -97,4 +107,37 @@ SEXPTYPE_MAP = {
 
 # Replacement for str_typeint
 def str_typeint(type_code: int) -> str:
-    return SEXPTYPE_MAP.get(type_code, f"UNKNOWN_TYPE({type_code})")
\ No newline at end of file
+    return SEXPTYPE_MAP.get(type_code, f"UNKNOWN_TYPE({type_code})")
+
+# Mapping of the names returned by R's typeof() to SEXP type names
+TYPEOF_MAP = {
+    "NULL": "NILSXP",
+    "symbol": "SYMSXP",
+    "pairlist": "LISTSXP",
+    "closure": "CLOSXP",
+    "environment": "ENVSXP",
+    "promise": "PROMSXP",
+    "language": "LANGSXP",
+    "special": "SPECIALSXP",
+    "builtin": "BUILTINSXP",
+    "char": "CHARSXP",
+    "logical": "LGLSXP",
+    "integer": "INTSXP",
+    "double": "REALSXP",
+    "complex": "CPLXSXP",
+    "character": "STRSXP",
+    "...": "DOTSXP",
+    "any": "ANYSXP",
+    "list": "VECSXP",
+    "expression": "EXPRSXP",
+    "bytecode": "BCODESXP",
+    "externalptr": "EXTPTRSXP",
+    "weakref": "WEAKREFSXP",
+    "raw": "RAWSXP",
+    "S4": "S4SXP",
+    "object": "S4SXP",
+}
+
+def str_typeof(type_name: str) -> str:
+    """Convert a typeof() name to the same string str_typeint gives for its type code."""
+    return TYPEOF_MAP.get(type_name, f"UNKNOWN_TYPE({type_name})")
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Background writer of generated tool files, into a directory or a single archive."""
+
+import hashlib
+import io
+import json
+import os
+import posixpath
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+from r2g2 import tracing
+
+# Table of contents added as the last member of an archive
+CONTENTS_FILENAME = 'r2g2_contents.json'
+
+ARCHIVE_EXTENSIONS = ('.tar.gz', '.tgz', '.tar', '.zip')
+
+
+class DirectorySink(object):
+    """Write files into a directory."""
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+
+    def write(self, filename, content):
+        with open(os.path.join(self.out_dir, filename), 'w+') as out:
+            out.write(content)
+
+    def close(self):
+        pass
+
+
+class ArchiveSink(object):
+    """
+    Stream files into a tar (optionally gzipped) or zip archive, without a file per tool.
+
+    The archive is written to a temporary file that replaces path once it is closed, with a table
+    of contents listing the name, size and sha256 of every member.
+    """
+
+    def __init__(self, path):
+        if not path.endswith(ARCHIVE_EXTENSIONS):
+            raise ValueError(f"Unsupported archive {path}, use one of {', '.join(ARCHIVE_EXTENSIONS)}")
+        self.path = path
+        self.contents = []
+        self._partial = f"{path}.partial"
+        self._mtime = time.time()
+        if path.endswith('.zip'):
+            self._tar = None
+            self._zip = zipfile.ZipFile(self._partial, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            self._zip = None
+            self._tar = tarfile.open(self._partial, 'w|' if path.endswith('.tar') else 'w|gz')
+
+    def write(self, filename, content):
+        data = content.encode('utf-8')
+        self._add(filename, data)
+        self.contents.append({'name': filename, 'bytes': len(data),
+                              'sha256': hashlib.sha256(data).hexdigest()})
+
+    def _add(self, filename, data):
+        if self._zip is not None:
+            self._zip.writestr(zipfile.ZipInfo(filename, time.localtime(self._mtime)[:6]), data,
+                               zipfile.ZIP_DEFLATED)
+        else:
+            info = tarfile.TarInfo(filename)
+            info.size = len(data)
+            info.mtime = self._mtime
+            info.mode = 0o644
+            self._tar.addfile(info, io.BytesIO(data))
+
+    def abort(self):
+        """Close and delete an incomplete archive."""
+        (self._zip or self._tar).close()
+        os.remove(self._partial)
+
+    def close(self):
+        self._add(CONTENTS_FILENAME, json.dumps({'files': self.contents}, indent=1).encode('utf-8'))
+        (self._zip or self._tar).close()
+        os.replace(self._partial, self.path)
+
+
+class ToolWriter(object):
+    """
+    Write files to a sink from a thread, so that the next function is processed while a tool is written.
+
+    At most max_pending files wait in the queue; write() blocks beyond that, which keeps memory flat
+    however large the package. Filenames are relative to prefix within the sink. Failed writes do not
+    stop the writer, they are collected in failures as (key, filename, error) once the writer is closed.
+    Without threaded, files are written by write() itself, for callers that fork while writing.
+    """
+
+    def __init__(self, sink, prefix='', max_pending=32, threaded=True):
+        self.sink = sink
+        self.prefix = prefix
+        self.failures = []
+        self._queue = None
+        self._thread = None
+        if threaded:
+            self._queue = queue.Queue(max_pending)
+            self._thread = threading.Thread(target=self._run, name='r2g2-writer', daemon=True)
+            self._thread.start()
+
+    def write(self, filename, content, key=None):
+        if self._queue is None:
+            self._write(filename, content, key)
+        else:
+            self._queue.put((filename, content, key))
+
+    def _write(self, filename, content, key):
+        filename = posixpath.join(self.prefix, filename) if self.prefix else filename
+        try:
+            with tracing.span('write', filename=filename):
+                self.sink.write(filename, content)
+        except Exception as e:
+            self.failures.append((key, filename, e))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            self._write(*item)
+
+    def close(self):
+        """Wait for the queued files to be written."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
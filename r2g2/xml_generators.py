@@ -3,6 +3,8 @@
 
 """Functions to generate various Galaxy XML files."""
 
+from r2g2.templates import optional_input_not_determined_macro, ellipsis_input_macro, rscript_ellipsis_token
+
 def generate_macro_xml(package_name, package_version, r_name, galaxy_tool_version):
     """Generate the Galaxy macros XML file."""
     macro_xml = '''<macros>
@@ -47,8 +49,13 @@ input_abundance <- t( input_abundance[ c( ${ ",".join( $fixed_sample_columns ) }
 
     <token name="@VERSION@">%(package_version)s</token>
 
+%(optional_input_not_determined_macro)s
+%(ellipsis_input_macro)s
+%(rscript_ellipsis_token)s
 </macros>''' % dict(package_name=package_name, package_version=package_version, 
-                    r_name=r_name, galaxy_tool_version=galaxy_tool_version)
+                    r_name=r_name, galaxy_tool_version=galaxy_tool_version, 
+                    optional_input_not_determined_macro=optional_input_not_determined_macro, 
+                    ellipsis_input_macro=ellipsis_input_macro, rscript_ellipsis_token=rscript_ellipsis_token)
     return macro_xml
 
 def generate_LOAD_MATRIX_TOOL_XML(package_name, package_version, r_name, galaxy_tool_version):
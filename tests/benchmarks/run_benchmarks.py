@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark r2g2-package against the packages that ship with R, and compare with a stored baseline.
+
+Every package is generated from scratch (no introspection cache, no manifest) in its own forked
+process, recording wall time, time per function, peak RSS and output bytes. The import time of
+both console scripts and the scaling of the R configfile builder with the number of formals are
+measured as well. Exits with status 1 when a metric regresses past the tolerance.
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+sys.path.insert(0, ROOT)
+
+from r2g2 import __version__, tracing
+
+DEFAULT_PACKAGES = ['stats', 'utils', 'methods', 'graphics']
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+CONSOLE_SCRIPTS = ['r2g2.scripts.r2g2_package', 'r2g2.scripts.r2g2_script']
+
+# Modules that must not be imported by the console scripts before they are needed
+HEAVY_MODULES = ['rpy2', 'jinja2', 'requests']
+
+# Number of formals of the synthetic functions used to measure the configfile builder
+CONFIGFILE_SIZES = [10, 100, 1000]
+
+# A regression in time smaller than this many seconds is considered noise
+TIME_FLOOR = 0.05
+
+# Prints the import time of a module and which heavy modules it imported
+IMPORT_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import %(module)s
+print(json.dumps({"seconds": time.perf_counter() - start,
+                  "heavy_modules": sorted(m for m in %(heavy)r if m in sys.modules)}))
+'''
+
+
+def peak_rss():
+    """Return the peak RSS in bytes of this process and its waited-for children."""
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return scale * max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                       resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def directory_bytes(path):
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            total += os.path.getsize(os.path.join(dirpath, filename))
+    return total
+
+
+def run_isolated(func, *args):
+    """Run func(*args) in a forked process, returning its result; R can only be loaded once per process."""
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+
+    def target():
+        try:
+            sender.send((func(*args), None))
+        except Exception as e:
+            sender.send((None, f'{type(e).__name__}: {e}'))
+
+    # Not a Pool: its daemonic workers could not fork the --jobs workers of r2g2-package
+    process = context.Process(target=target)
+    process.start()
+    try:
+        result, error = receiver.recv()
+    except EOFError:
+        result, error = None, 'benchmark process died'
+    process.join()
+    if error is not None:
+        raise RuntimeError(error)
+    return result
+
+
+def benchmark_package(r_name, jobs, help_renderer, verbose):
+    """Generate all tools of a package into a temporary directory and measure it."""
+    from r2g2.scripts.r2g2_package import generate_package
+
+    out_dir = tempfile.mkdtemp(prefix=f'r2g2_benchmark_{r_name}_')
+    try:
+        tracing.enable()
+        with contextlib.ExitStack() as stack:
+            if not verbose:
+                stack.enter_context(contextlib.redirect_stdout(open(os.devnull, 'w')))
+            start = time.perf_counter()
+            summary = generate_package(r_name, out_dir, jobs=jobs, force=True, help_renderer=help_renderer)
+            wall_time = time.perf_counter() - start
+
+        # A function costs its processing span plus the span writing its tool
+        functions = {}
+        for event in tracing.drain():
+            if event['cat'] in ('function', 'output'):
+                functions[event['name']] = functions.get(event['name'], 0.0) + event['dur'] / 1e6
+        return {
+            'wall_time': wall_time,
+            'peak_rss': peak_rss(),
+            'output_bytes': directory_bytes(out_dir),
+            'tools': summary['created'],
+            'skipped': summary['skipped'],
+            'functions': functions,
+        }
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def benchmark_import(module, repeat):
+    """Return the best import time of a module over fresh interpreters, and the heavy modules it loads."""
+    best = None
+    for i in range(repeat):
+        output = subprocess.run([sys.executable, '-c', IMPORT_PROBE % dict(module=module, heavy=HEAVY_MODULES)],
+                                check=True, capture_output=True, text=True, cwd=ROOT).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    return best
+
+
+def benchmark_configfile(repeat):
+    """Time generate_r_script for growing numbers of formals; an exponent near 1 means linear scaling."""
+    from r2g2.scripts.r2g2_package import generate_r_script
+
+    input_types = ['dataset', 'not_determined', 'text', 'integer', 'float', 'boolean', 'select', 'ellipsis']
+    seconds = {}
+    for size in CONFIGFILE_SIZES:
+        input_names = [(f'arg.{i}', f'arg_{i}', input_types[i % len(input_types)], i % 2 == 0)
+                       for i in range(size)]
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            generate_r_script('benchmark', 'r2g2', input_names)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        seconds[str(size)] = best
+    smallest, largest = str(CONFIGFILE_SIZES[0]), str(CONFIGFILE_SIZES[-1])
+    exponent = math.log(seconds[largest] / seconds[smallest]) / math.log(int(largest) / int(smallest))
+    return {'seconds': seconds, 'exponent': exponent}
+
+
+def compare(results, baseline, tolerance):
+    """Return (regressions, notes) of results against a baseline."""
+    regressions = []
+    notes = []
+
+    def check(label, current, previous, floor=0):
+        if previous and current > previous * (1 + tolerance) and current - previous > floor:
+            regressions.append(f'{label}: {previous:.6g} -> {current:.6g} (+{100.0 * (current / previous - 1):.1f}%)')
+
+    for r_name, result in results['packages'].items():
+        previous = baseline.get('packages', {}).get(r_name)
+        if previous is None:
+            notes.append(f'{r_name}: not in the baseline')
+            continue
+        check(f'{r_name} wall time (s)', result['wall_time'], previous['wall_time'], TIME_FLOOR)
+        check(f'{r_name} peak RSS (bytes)', result['peak_rss'], previous['peak_rss'])
+        check(f'{r_name} output bytes', result['output_bytes'], previous['output_bytes'])
+        for rname, seconds in sorted(result['functions'].items()):
+            previous_seconds = previous['functions'].get(rname)
+            if previous_seconds and seconds > previous_seconds * (1 + tolerance) and seconds - previous_seconds > TIME_FLOOR:
+                notes.append(f'{r_name}::{rname} slower: {previous_seconds:.3f}s -> {seconds:.3f}s')
+
+    for module, result in results['imports'].items():
+        previous = baseline.get('imports', {}).get(module)
+        if previous is not None:
+            check(f'import {module} (s)', result['seconds'], previous['seconds'], TIME_FLOOR)
+    return regressions, notes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--package", help="R package to benchmark; may be repeated (default: %s)" % ', '.join(DEFAULT_PACKAGES),
+                        action='append', default=None)
+    parser.add_argument("--jobs", help="Worker processes per package, as r2g2-package --jobs", type=int, default=1)
+    parser.add_argument("--help_renderer", help="As r2g2-package --help_renderer", default='rd2txt')
+    parser.add_argument("--baseline", help="Baseline JSON to compare with", default=DEFAULT_BASELINE)
+    parser.add_argument("--update_baseline", help="Write the results to the baseline instead of comparing",
+                        action='store_true')
+    parser.add_argument("--output", help="Also write the results to this JSON file", default=None)
+    parser.add_argument("--tolerance", help="Relative increase over the baseline reported as a regression",
+                        type=float, default=0.25)
+    parser.add_argument("--max_exponent", help="Largest acceptable scaling exponent of the configfile builder",
+                        type=float, default=1.3)
+    parser.add_argument("--repeat", help="Repetitions of the import and configfile measurements", type=int, default=5)
+    parser.add_argument("--skip_packages", help="Only measure imports and the configfile builder, without R",
+                        action='store_true')
+    parser.add_argument("--verbose", help="Show the output of r2g2-package", action='store_true')
+    args = parser.parse_args()
+
+    results = {
+        'r2g2_version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'packages': {},
+        'imports': {},
+    }
+    failures = []
+
+    for module in CONSOLE_SCRIPTS:
+        result = results['imports'][module] = benchmark_import(module, args.repeat)
+        print(f"import {module}: {result['seconds'] * 1000:.1f} ms")
+        if result['heavy_modules']:
+            failures.append(f"import {module} loads {', '.join(result['heavy_modules'])}")
+
+    results['configfile'] = benchmark_configfile(args.repeat)
+    for size, seconds in results['configfile']['seconds'].items():
+        print(f"generate_r_script, {size} formals: {seconds * 1000:.3f} ms")
+    print(f"generate_r_script scaling exponent: {results['configfile']['exponent']:.2f}")
+    if results['configfile']['exponent'] > args.max_exponent:
+        failures.append(f"generate_r_script scales with exponent {results['configfile']['exponent']:.2f}")
+
+    if not args.skip_packages:
+        print('')
+        print(f"{'Package':<12} {'Wall (s)':>10} {'Peak RSS (MB)':>14} {'Output (KB)':>12} {'Tools':>6}  Slowest functions")
+        for r_name in args.package or DEFAULT_PACKAGES:
+            try:
+                result = run_isolated(benchmark_package, r_name, args.jobs, args.help_renderer, args.verbose)
+            except RuntimeError as e:
+                failures.append(f'{r_name}: {e}')
+                print(f'{r_name:<12} failed: {e}')
+                continue
+            results['packages'][r_name] = result
+            slowest = sorted(result['functions'].items(), key=lambda item: -item[1])[:3]
+            print(f"{r_name:<12} {result['wall_time']:>10.2f} {result['peak_rss'] / 2 ** 20:>14.1f} "
+                  f"{result['output_bytes'] / 1024:>12.1f} {result['tools']:>6}  "
+                  f"{', '.join(f'{rname} {seconds:.3f}s' for rname, seconds in slowest)}")
+
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+
+    print('')
+    if args.update_baseline:
+        with open(args.baseline, 'w') as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+        print(f'Wrote baseline: {args.baseline}')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        print(f"Comparing with {args.baseline} (r2g2 {baseline.get('r2g2_version')}, "
+              f"Python {baseline.get('python')}, {baseline.get('platform')})")
+        regressions, notes = compare(results, baseline, args.tolerance)
+        for note in notes:
+            print(f'  {note}')
+        failures.extend(regressions)
+    else:
+        print(f'No baseline at {args.baseline}, create one with --update_baseline')
+
+    for failure in failures:
+        print(f'REGRESSION {failure}')
+    if failures:
+        sys.exit(1)
+    print('No regressions')
+
+
+if __name__ == "__main__":
+    main()
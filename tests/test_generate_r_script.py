@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""The configfile builder of r2g2-package: unchanged output, and time linear in the number of formals."""
+
+import math
+import os
+import time
+
+from r2g2.scripts.r2g2_package import generate_r_script
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data')
+
+INPUT_NAMES = [
+    ('x', 'x', 'dataset', False),
+    ('formula', 'formula', 'not_determined', False),
+    ('method', 'method', 'choice', True),
+    ('label', 'label', 'text', True),
+    ('n.iter', 'n_iter', 'integer', False),
+    ('verbose', 'verbose', 'boolean', False),
+    ('...', '___ellipsis___', 'ellipsis', False),
+]
+
+INPUT_TYPES = ['dataset', 'not_determined', 'text', 'integer', 'float', 'boolean', 'select', 'ellipsis']
+
+# Numbers of formals timed; quadratic copying would make the larger one 400 times slower
+SCALING_SIZES = (100, 2000)
+
+# Largest acceptable exponent of time in the number of formals, as run_benchmarks.py --max_exponent
+MAX_EXPONENT = 1.3
+
+
+def best_time(input_names, repeat=5):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        generate_r_script('benchmark', 'r2g2', input_names)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def test_generate_r_script_output():
+    with open(os.path.join(TEST_DATA, 'generate_r_script.txt')) as fh:
+        expected = fh.read()
+    assert generate_r_script('fit.model', 'stats', INPUT_NAMES) == expected
+
+
+def test_generate_r_script_scaling():
+    smallest, largest = SCALING_SIZES
+    seconds = {}
+    for size in SCALING_SIZES:
+        seconds[size] = best_time([(f'arg.{i}', f'arg_{i}', INPUT_TYPES[i % len(INPUT_TYPES)], i % 2 == 0)
+                                   for i in range(size)])
+    exponent = math.log(seconds[largest] / seconds[smallest]) / math.log(largest / smallest)
+    assert exponent <= MAX_EXPONENT, \
+        f'{smallest} formals: {seconds[smallest] * 1000:.2f} ms, {largest}: {seconds[largest] * 1000:.2f} ms'
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""The console scripts must start without importing rpy2, jinja2 or requests, within a time budget."""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+# Cumulative import time allowed per console script module, in microseconds
+IMPORT_BUDGETS = {
+    'r2g2.scripts.r2g2_package': 300000,
+    'r2g2.scripts.r2g2_script': 300000,
+}
+
+HEAVY_MODULES = ('rpy2', 'jinja2', 'requests')
+
+
+def import_times(module):
+    """Return {module: cumulative microseconds} from python -X importtime."""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=ROOT,
+                            check=True, capture_output=True, text=True).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative_us)
+    return times
+
+
+@pytest.mark.parametrize('module', sorted(IMPORT_BUDGETS))
+def test_console_script_import(module):
+    times = import_times(module)
+    heavy = sorted(name for name in times if name.split('.')[0] in HEAVY_MODULES)
+    assert not heavy, f'{module} imports {", ".join(heavy)}'
+    assert times[module] <= IMPORT_BUDGETS[module], \
+        f'{module} took {times[module] / 1000:.1f} ms to import, over {IMPORT_BUDGETS[module] / 1000:.0f} ms'
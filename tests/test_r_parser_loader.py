@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Rebuilding the parsers of an R script from the argument strings written by FakeArg.r, without eval."""
+
+import pytest
+
+from r2g2.parsers.r_parser import extract_simple_parser_info, load_parsers, parse_argument_string
+
+
+def test_parse_argument_string():
+    assert parse_argument_string("parser_group0 = parser.add_argument_group('Input')") == \
+        ('parser_group0', 'parser', 'add_argument_group', ['Input'], {})
+    assert parse_argument_string("parser.add_argument('--n', type=int, default=3)") == \
+        (None, 'parser', 'add_argument', ['--n'], {'type': int, 'default': 3})
+
+
+def test_load_parsers_groups():
+    blankenberg_parameters, parser = load_parsers([
+        "parser_group0 = parser.add_argument_group('Input')",
+        "parser_group0.add_argument('--input', type=str, help='Input file')",
+        "parser.add_argument('--verbose', action='store_true')",
+    ])
+    assert extract_simple_parser_info(parser)['groups'] == {'Input': ['--input'], 'options': ['--help', '--verbose']}
+    assert parser.parse_args(['--input', 'a.tsv']).input == 'a.tsv'
+    assert [args for args, kwargs in blankenberg_parameters._oynaxraoret_args] == [('-h', '--help'), ('--input',), ('--verbose',)]
+
+
+def test_load_parsers_mutually_exclusive_groups():
+    blankenberg_parameters, parser = load_parsers([
+        "parser_mutually_exclusive_group0 = parser.add_mutually_exclusive_group(required=True)",
+        "parser_mutually_exclusive_group0.add_argument('--fast', action='store_true')",
+        "parser_mutually_exclusive_group0.add_argument('--slow', action='store_true')",
+    ])
+    assert extract_simple_parser_info(parser)['mutually_exclusive_groups'] == {'group0': ['--fast', '--slow']}
+    with pytest.raises(SystemExit):
+        parser.parse_args(['--fast', '--slow'])
+
+
+def test_load_parsers_subparsers():
+    blankenberg_parameters, parser = load_parsers([
+        "parser_subparsers = parser.add_subparsers(dest='command')",
+        "parser_subparsers_subparser0 = parser_subparsers.add_parser('align')",
+        "parser_subparsers_subparser0.add_argument('--reads', type=str)",
+        "parser_subparsers_subparser1 = parser_subparsers.add_parser('count')",
+        "parser_subparsers_subparser1.add_argument('--min', type=int, default=1)",
+    ])
+    subparsers = extract_simple_parser_info(parser)['subparsers']
+    assert sorted(subparsers) == ['align', 'count']
+    assert subparsers['count']['groups']['options'] == ['--help', '--min']
+    assert parser.parse_args(['count', '--min', '5']).min == 5
+
+
+def test_load_parsers_rejects_unknown_name():
+    with pytest.raises(ValueError, match='Unsupported name in argument: open'):
+        load_parsers(["parser.add_argument('--x', type=open)"])
+
+
+def test_load_parsers_rejects_other_calls():
+    with pytest.raises(ValueError, match='Unsupported call'):
+        load_parsers(["__import__('os').system('true')"])
+    with pytest.raises(ValueError, match='Unsupported call'):
+        load_parsers(["parser.parse_args()"])
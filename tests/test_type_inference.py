@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Typing of formals from Rd argument descriptions, as sent by RD_DB_INDEX in Rd source form."""
+
+import pytest
+
+from r2g2.type_inference import clean_rd_text, infer_input_type
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('a \\code{character} string naming the method', 'a character string naming the method'),
+    ('logical; if \\code{TRUE}, print\n   progress', 'logical; if TRUE, print progress'),
+    ('a \\link[stats]{formula} object', 'a formula object'),
+    ('\\sQuote{x} as a \\code{\\link{data.frame}}', 'x as a data.frame'),
+])
+def test_clean_rd_text(text, expected):
+    assert clean_rd_text(text) == expected
+
+
+@pytest.mark.parametrize('description, expected', [
+    ('a \\code{character} string naming the method', 'text'),
+    ('\\code{logical}; if \\code{TRUE} the output is verbose', 'boolean'),
+    ('a \\code{\\link{data.frame}} with the observations', 'dataset'),
+    ('a numeric \\code{\\link{matrix}}', 'dataset'),
+    ('\\code{integer}: the number of iterations', 'integer'),
+    ('a positive \\code{numeric} tolerance', 'float'),
+    ('a \\code{numeric} or \\code{character} vector', None),
+    ('a \\code{\\link{function}} applied to each element', None),
+    ('further arguments passed to \\code{\\link{plot}}', None),
+    ('', None),
+])
+def test_infer_input_type_with_markup(description, expected):
+    assert infer_input_type(description) == expected
+